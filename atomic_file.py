@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Atomic file writes
+Data goes to a temp file beside the target and then replaces it in one
+rename, so readers never see a half-written file. The temp name carries
+the pid, so two processes saving the same file never share one.
+"""
+
+import json
+import os
+
+def write_atomic(path, data, mode='w'):
+    """Replace path with data (str, or bytes with mode='wb')"""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_json(path, data, **dump_kwargs):
+    write_atomic(path, json.dumps(data, **dump_kwargs))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Classifier micro-benchmark
+Times the old chained substring checks against the classifier's
+precomputed lowercase keyword tables over a synthetic corpus of
+receipt-like email bodies
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from subscription_classifier import classify, default_classifier
+
+SENDERS = [
+    'Anthropic <billing@anthropic.com>', 'Apple <no_reply@email.apple.com>',
+    'Spline <billing@spline.design>', 'Autodesk <store@autodesk.com>',
+    'Polycam <hello@poly.cam>', '"Netflix" <info@account.netflix.com>',
+    'receipts@stripe.com', 'Dropbox <no-reply@dropbox.com>'
+]
+PHRASES = [
+    'Thanks for your purchase.', 'Your plan renews automatically.',
+    'You can cancel any time from your account settings.',
+    'Questions? Reply to this email.', 'Order summary', 'Tax included.',
+    'This is your monthly receipt.', 'Billed annually.', 'per month',
+    '/year', 'Your subscription is active.', 'Invoice attached.'
+]
+
+def legacy_classify(sender, text):
+    """The chained checks extract_email_details used before the classifier"""
+    company = ''
+    if 'anthropic' in sender.lower():
+        company = 'Anthropic Claude'
+    elif 'apple' in sender.lower():
+        company = 'Apple'
+    elif 'spline' in sender.lower():
+        company = 'Spline'
+    elif 'autodesk' in sender.lower():
+        company = 'Autodesk'
+    elif 'polycam' in sender.lower():
+        company = 'Polycam'
+    
+    amounts = re.findall(r'\$(\d+(?:,\d{3})*(?:\.\d{2})?)', text)
+    amount = None
+    for amt in amounts:
+        val = float(amt.replace(',', ''))
+        if val > 0:
+            amount = val
+            break
+    
+    frequency = None
+    text_lower = text.lower()
+    if 'monthly' in text_lower or 'per month' in text_lower or '/month' in text_lower:
+        frequency = 'monthly'
+    elif 'annual' in text_lower or 'yearly' in text_lower or 'per year' in text_lower or '/year' in text_lower:
+        frequency = 'yearly'
+    
+    return company or None, amount, frequency
+
+def make_corpus(count, seed=1):
+    """Deterministic synthetic (sender, text) pairs"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        words = rng.choices(PHRASES, k=rng.randint(5, 40))
+        if rng.random() < 0.7:
+            words.insert(rng.randrange(len(words) + 1), f'Total: ${rng.randint(0, 2500)}.{rng.randint(0, 99):02d}')
+        corpus.append((rng.choice(SENDERS), ' '.join(words)))
+    return corpus
+
+def bench(fn, corpus):
+    start = time.perf_counter()
+    results = [fn(sender, text) for sender, text in corpus]
+    return time.perf_counter() - start, results
+
+def main():
+    parser = argparse.ArgumentParser(description='Classifier micro-benchmark')
+    parser.add_argument('--count', type=int, default=100_000, help='synthetic bodies to classify')
+    args = parser.parse_args()
+    
+    corpus = make_corpus(args.count)
+    default_classifier()  # Build the tables outside the timed region
+    
+    legacy_time, legacy_results = bench(legacy_classify, corpus)
+    compiled_time, compiled_results = bench(classify, corpus)
+    
+    mismatches = sum(1 for a, b in zip(legacy_results, compiled_results) if a != b)
+    size_mb = sum(len(text) for _, text in corpus) / 1e6
+    
+    print(f"Corpus: {args.count:,} bodies, {size_mb:.1f} MB")
+    print(f"  legacy chained checks:  {legacy_time:7.3f}s  ({args.count / legacy_time:,.0f} msg/s)")
+    print(f"  compiled classifier:    {compiled_time:7.3f}s  ({args.count / compiled_time:,.0f} msg/s)")
+    print(f"  speedup:                {legacy_time / compiled_time:7.2f}x")
+    print(f"  mismatches:             {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
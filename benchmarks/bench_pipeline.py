@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+End-to-end pipeline benchmarks
+Runs the Gmail and Calendar entry points against the fake backends in
+fake_google.py for a range of mailbox sizes and reports wall time, API
+round trips, peak RSS and per-stage timings. Each case runs in its own
+process so peak RSS and the per-process client caches start clean.
+
+Usage:
+  python3 benchmarks/bench_pipeline.py                          # all targets, 100..100k
+  python3 benchmarks/bench_pipeline.py --sizes 1000 --latency 40
+  python3 benchmarks/bench_pipeline.py --sizes 1000 --quota 250 --error-rate 0.05
+  python3 benchmarks/bench_pipeline.py --sizes 1000 --latency 40 --async   # google_async over HTTP
+  python3 benchmarks/bench_pipeline.py --save bench_baseline.json
+  python3 benchmarks/bench_pipeline.py --baseline bench_baseline.json   # exits 1 on regression
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = (
+    'search_subscription_emails', 'extract_email_details', 'extract_subscription_info',
+    'categorize_subscriptions', 'subscription_analyzer', 'check_urgent_emails',
+    'check_upcoming_events'
+)
+SIZES = (100, 1_000, 10_000, 100_000)
+TOLERANCE = 0.25
+# Timing differences smaller than this are noise, whatever the ratio
+NOISE_SECONDS = 0.05
+
+# Calendars are much smaller than mailboxes
+EVENTS_PER_MESSAGE = 0.1
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def load_skill(name):
+    """Import a hyphenated skills/<name>.py script as a module"""
+    path = os.path.join(ROOT, 'skills', f'{name}.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class Stages:
+    """Wall time (and, for blocking stages, API round trips) per pipeline stage"""
+    
+    def __init__(self, *services):
+        self.services = services
+        self.times = {}
+        self.calls = {}
+        self._inclusive = {}
+    
+    def _round_trips(self):
+        return sum(service.round_trips for service in self.services)
+    
+    @contextlib.contextmanager
+    def stage(self, name):
+        start, calls = time.perf_counter(), self._round_trips()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+            self.calls[name] = self.calls.get(name, 0) + self._round_trips() - calls
+    
+    def iterate(self, name, iterable, inner=None):
+        """
+        Time each next() on iterable, minus the time spent inside the
+        inner stage's iterator. Round trips aren't attributed here since
+        searches keep listing on background threads.
+        """
+        self.times.setdefault(name, 0.0)  # Report stages in pipeline order
+        return self._timed(name, iter(iterable), inner)
+    
+    def _timed(self, name, iterator, inner):
+        while True:
+            start = time.perf_counter()
+            inner_before = self._inclusive.get(inner, 0.0)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - start
+                self._inclusive[name] = self._inclusive.get(name, 0.0) + elapsed
+                self.times[name] += elapsed - (self._inclusive.get(inner, 0.0) - inner_before)
+            yield item
+
+# --- Targets: each takes (mailbox, gmail, calendar, stages) -------------------
+
+def bench_search_subscription_emails(mailbox, gmail, calendar, stages):
+    import subscription_analyzer
+    with stages.stage('search'):
+        ids = [m['id'] for m in subscription_analyzer.search_subscription_emails(gmail)]
+    return {'messages': len(ids)}
+
+def bench_extract_email_details(mailbox, gmail, calendar, stages):
+    import subscription_analyzer
+    with stages.stage('search'):
+        ids = [m['id'] for m in subscription_analyzer.search_subscription_emails(gmail)]
+    with stages.stage('extract'):
+        details = [subscription_analyzer.extract_email_details(gmail, i) for i in ids]
+    return {'messages': len(ids), 'with_amount': sum(1 for d in details if d and d['amount'])}
+
+def bench_extract_subscription_info(mailbox, gmail, calendar, stages):
+    import gmail_subscription_scanner
+    with stages.stage('search'):
+        ids = [m['id'] for m in gmail_subscription_scanner.search_subscription_emails(gmail, max_results=None)]
+    with stages.stage('extract'):
+        infos = [gmail_subscription_scanner.extract_subscription_info(gmail, i) for i in ids]
+    return {'messages': len(ids), 'with_amount': sum(1 for info in infos if info)}
+
+def bench_categorize_subscriptions(mailbox, gmail, calendar, stages):
+    import subscription_analyzer
+    from gmail_batch import parse_message
+    with stages.stage('parse'):
+        records = [subscription_analyzer.parse_email_details(parse_message(mailbox.resource(m.id)))
+                   for m in mailbox.messages]
+    with stages.stage('categorize'):
+        monthly, yearly, unknown = subscription_analyzer.categorize_subscriptions(records)
+    return {'records': len(records), 'companies': len(monthly) + len(yearly) + len(unknown)}
+
+def bench_subscription_analyzer(mailbox, gmail, calendar, stages):
+    """What subscription_analyzer.main() does, without the 150 message cap"""
+    import subscription_analyzer
+    from gmail_pipeline import stream_candidates
+    from subscription_ledger import Ledger
+    ledger = Ledger()
+    messages = stages.iterate('search', subscription_analyzer.search_subscription_emails(gmail))
+    candidates = stages.iterate('fetch', stream_candidates(gmail, (m['id'] for m in messages)),
+                                inner='search')
+    results = stages.iterate('classify', map(subscription_analyzer.parse_email_details, candidates),
+                             inner='fetch')
+    processed = 0
+    for processed, details in enumerate(results, 1):
+        ledger.add(details)
+    with stages.stage('rollup'):
+        subscription_analyzer.categorize_subscriptions(ledger)
+        totals = ledger.rollup('max')
+    return {'messages': processed, 'annual_cost': round(totals['total_annual_cost'], 2)}
+
+def bench_check_urgent_emails(mailbox, gmail, calendar, stages, workdir):
+    gmail_check = load_skill('check-gmail')
+    gmail_check.get_service = lambda *args, **kwargs: gmail
+    gmail_check.TOKEN_FILE = os.path.join(workdir, 'token.pickle')
+    gmail_check.HISTORY_FILE = os.path.join(workdir, 'gmail-history.json')
+    gmail_check.SEEN_FILE = os.path.join(workdir, 'gmail-seen.json')
+    open(gmail_check.TOKEN_FILE, 'w').close()
+    # Heartbeat pattern: a cold run, then a tick with nothing new
+    with stages.stage('cold'):
+        cold = gmail_check.check_urgent_emails(24, incremental=True)
+    with stages.stage('warm'):
+        gmail_check.check_urgent_emails(24, incremental=True)
+    if 'error' in cold:
+        raise RuntimeError(cold['error'])
+    return {'urgent': cold['count']}
+
+def bench_check_upcoming_events(mailbox, gmail, calendar, stages, workdir):
+    calendar_check = load_skill('check-calendar')
+    calendar_check.get_service = lambda *args, **kwargs: calendar
+    calendar_check.TOKEN_FILE = os.path.join(workdir, 'token.pickle')
+    calendar_check.INDEX_FILE = os.path.join(workdir, 'calendar-index.json')
+    open(calendar_check.TOKEN_FILE, 'w').close()
+    with stages.stage('cold'):
+        cold = calendar_check.check_upcoming_events(48)
+    with stages.stage('warm'):
+        calendar_check.check_upcoming_events(48)
+    if 'error' in cold:
+        raise RuntimeError(cold['error'])
+    return {'events': len(stages.services[1].schedule), 'upcoming': cold['total_count']}
+
+def run_case(target, size, latency, mailbox_file=None, quota=None, error_rate=0.0,
+             use_async=False):
+    """
+    Run one target in this process and return its measurements. With
+    use_async the fakes sit behind stub_server and the target talks to
+    them over HTTP through google_async.
+    """
+    from fake_google import Mailbox, FakeGmail, FakeCalendar
+    mailbox = Mailbox.from_file(mailbox_file) if mailbox_file else Mailbox.synthetic(size)
+    gmail = FakeGmail(mailbox, latency, quota=quota, error_rate=error_rate)
+    calendar = FakeCalendar(max(10, int(len(mailbox) * EVENTS_PER_MESSAGE)), latency)
+    backend_rss = peak_rss_mb()
+    
+    gmail_client, calendar_client = gmail, calendar
+    if use_async:
+        from stub_server import serve
+        from google_async import build_async_service
+        server, url = serve(gmail, calendar)
+        gmail_client = build_async_service('gmail', 'v1', None, root_url=f'{url}/gmail/v1')
+        calendar_client = build_async_service('calendar', 'v3', None, root_url=f'{url}/calendar/v3')
+    
+    stages = Stages(gmail, calendar)
+    bench = globals()[f'bench_{target}']
+    with tempfile.TemporaryDirectory() as workdir, contextlib.redirect_stdout(io.StringIO()):
+        args = (mailbox, gmail_client, calendar_client, stages)
+        if target.startswith('check_'):
+            args += (workdir,)
+        start = time.perf_counter()
+        output = bench(*args)
+        elapsed = time.perf_counter() - start
+    
+    calls = {}
+    for service in (gmail, calendar):
+        for method, count in service.stats()['calls'].items():
+            calls[method] = calls.get(method, 0) + count
+    return {
+        'target': target,
+        'size': len(mailbox),
+        'latency_ms': latency * 1000,
+        'async': use_async,
+        'seconds': elapsed,
+        'round_trips': gmail.round_trips + calendar.round_trips,
+        'rejected': gmail.stats()['rejected'],
+        # Query matching etc. in the fake, included in seconds (overlaps with it when threaded)
+        'server_seconds': gmail.server_seconds + calendar.server_seconds,
+        'calls': calls,
+        'peak_rss_mb': peak_rss_mb(),
+        'backend_rss_mb': backend_rss,
+        'stages': {name: {'seconds': seconds, 'round_trips': stages.calls.get(name)}
+                   for name, seconds in stages.times.items()},
+        'output': output
+    }
+
+def run_isolated(target, size, latency, mailbox_file=None, quota=None, error_rate=0.0,
+                 use_async=False):
+    """run_case() in a fresh interpreter"""
+    command = [sys.executable, os.path.abspath(__file__), '--case', target, str(size),
+               '--latency', str(latency * 1000), '--error-rate', str(error_rate)]
+    if use_async:
+        command.append('--async')
+    if mailbox_file:
+        command += ['--mailbox', mailbox_file]
+    if quota:
+        command += ['--quota', str(quota)]
+    proc = subprocess.run(command, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {'target': target, 'size': size, 'error': proc.stderr.strip().splitlines()[-1:]}
+    return json.loads(proc.stdout)
+
+def print_result(result):
+    if 'error' in result:
+        print(f"{result['target']:28} {result['size']:>8,}  ❌ {' '.join(result['error'])}")
+        return
+    stages = '  '.join(f"{name} {stage['seconds']:.3f}s"
+                       + ('' if stage['round_trips'] is None else f"/{stage['round_trips']}")
+                       for name, stage in result['stages'].items())
+    print(f"{result['target']:28} {result['size']:>8,} {result['seconds']:9.3f}s "
+          f"{result['server_seconds']:9.3f}s {result['round_trips']:8,} "
+          f"{result['peak_rss_mb']:8.1f}MB  {stages}")
+
+def compare(results, baseline, tolerance):
+    """Regressions against a saved run: slower or bigger beyond tolerance, or more API calls"""
+    previous = {(r['target'], r['size']): r for r in baseline if 'error' not in r}
+    regressions = []
+    for result in results:
+        if 'error' in result:
+            regressions.append(f"{result['target']} @ {result['size']:,}: failed")
+            continue
+        old = previous.get((result['target'], result['size']))
+        if old is None:
+            continue
+        name = f"{result['target']} @ {result['size']:,}"
+        if result['round_trips'] > old['round_trips']:
+            regressions.append(f"{name}: round trips {old['round_trips']:,} -> {result['round_trips']:,}")
+        slower = result['seconds'] - old['seconds']
+        if result['seconds'] > old['seconds'] * (1 + tolerance) and slower > NOISE_SECONDS:
+            regressions.append(f"{name}: time {old['seconds']:.3f}s -> {result['seconds']:.3f}s")
+        if result['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {old['peak_rss_mb']:.1f}MB -> {result['peak_rss_mb']:.1f}MB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end pipeline benchmarks against a fake Google backend')
+    parser.add_argument('--targets', default=','.join(TARGETS),
+                        help='comma-separated targets (default: all)')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='comma-separated mailbox sizes (default: 100,1000,10000,100000)')
+    parser.add_argument('--latency', type=float, default=0.0, metavar='MS',
+                        help='simulated latency per HTTP round trip')
+    parser.add_argument('--quota', type=float, metavar='UNITS',
+                        help='make the fake enforce a per-second Gmail quota (429 + Retry-After past it)')
+    parser.add_argument('--error-rate', type=float, default=0.0, metavar='P',
+                        help='fraction of Gmail calls that randomly fail with 429 or 503')
+    parser.add_argument('--mailbox', metavar='FILE',
+                        help='replay a recorded mailbox (see fake_google.record_mailbox) instead of synthetic mail')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='runs per case; the fastest is kept')
+    parser.add_argument('--save', metavar='FILE', help='write results as JSON')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare against a saved run and exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='allowed slowdown / RSS growth against the baseline (default 0.25)')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='serve the fakes over HTTP (stub_server) and use google_async')
+    parser.add_argument('--case', nargs=2, metavar=('TARGET', 'SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    latency = args.latency / 1000
+    
+    if args.case:
+        print(json.dumps(run_case(args.case[0], int(args.case[1]), latency, args.mailbox,
+                                  args.quota, args.error_rate, args.use_async)))
+        return
+    
+    targets = [t for t in args.targets.split(',') if t]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+    sizes = [0] if args.mailbox else [int(s) for s in args.sizes.split(',')]
+    
+    print(f"{'target':28} {'size':>8} {'time':>10} {'in fake':>10} {'requests':>8} {'peak RSS':>10}"
+          "  stages (time/requests)")
+    results = []
+    for size in sizes:
+        for target in targets:
+            runs = [run_isolated(target, size, latency, args.mailbox, args.quota, args.error_rate,
+                                 args.use_async)
+                    for _ in range(args.repeat)]
+            ok = [run for run in runs if 'error' not in run]
+            result = min(ok, key=lambda run: run['seconds']) if ok else runs[0]
+            print_result(result)
+            results.append(result)
+    
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Saved results to {args.save}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\n❌ Regressions against", args.baseline)
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print(f"\n✅ No regressions against {args.baseline}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Fake Gmail and Calendar backends for benchmarks
+Drop-in stand-ins for the service objects build() returns, serving a
+synthetic or recorded mailbox with a configurable round-trip latency and
+counting every API call
+"""
+
+import base64
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import datetime, timezone
+from email.utils import formatdate
+import httplib2
+from googleapiclient.errors import HttpError
+from mime_walker import extract_body
+from rate_limit import QUOTA_UNITS, DEFAULT_UNITS
+
+# One Gmail message as the fake server stores it
+Message = namedtuple('Message', 'id sender subject timestamp labels body html_only')
+
+VENDOR_RECEIPTS = [
+    ('Anthropic <billing@anthropic.com>', 'Your Claude Pro receipt', 20.00, 'monthly'),
+    ('Apple <no_reply@email.apple.com>', 'Your receipt from Apple', 9.99, 'monthly'),
+    ('Spline <billing@spline.design>', 'Your subscription renewal', 99.00, 'yearly'),
+    ('Autodesk <store@autodesk.com>', 'Your subscription renewal', 545.00, 'yearly'),
+    ('Polycam <hello@poly.cam>', 'Your plan has renewed', 7.99, 'monthly'),
+    ('"Netflix" <info@account.netflix.com>', 'Your monthly payment', 15.49, 'monthly'),
+    ('Dropbox <no-reply@dropbox.com>', 'Your invoice', 119.88, 'yearly'),
+]
+OTHER_SENDERS = [
+    'Mt Hood Meadows <news@skihood.com>', 'GitHub <noreply@github.com>',
+    'Timberline Lodge <info@timberlinelodge.com>', 'Alex <alex@example.com>',
+    'REI Co-op <rei@notices.rei.com>', 'Strava <no-reply@strava.com>',
+    'Jordan <jordan@example.org>', 'Medium Daily Digest <noreply@medium.com>'
+]
+OTHER_SUBJECTS = [
+    'Powder day alert', 'Weekend conditions report', '[repo] New pull request',
+    'Lunch on Friday?', 'Your weekly summary', 'Season pass holders: early access',
+    'Trip photos', 'Members save 20% this week', 'Re: carpool to Meadows'
+]
+URGENT_SUBJECTS = ['URGENT: lift ticket refund', 'Important: account notice', 'Need this ASAP']
+FILLER = [
+    'Thanks for being a customer.', 'You can manage your account settings online.',
+    'Questions? Reply to this email.', 'View this email in your browser.',
+    'Fresh snow overnight with more on the way.', 'Unsubscribe at any time.',
+    'Here is what happened this week.', 'Sent from my phone.'
+]
+
+MAILBOX_YEARS = 2
+RECEIPT_SHARE = 0.06
+URGENT_SHARE = 0.02
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+def http_error(status, retry_after=None):
+    headers = {'status': status}
+    if retry_after is not None:
+        headers['retry-after'] = str(retry_after)
+    return HttpError(httplib2.Response(headers), b'')
+
+class Mailbox:
+    """Messages newest first, plus a cache of which ones each query matches"""
+    
+    def __init__(self, messages, raw=None):
+        self.messages = messages
+        self.by_id = {m.id: m for m in messages}
+        self.raw = raw or {}       # id -> recorded API resource, replayed as-is
+        self._matches = {}
+        self.history_id = 1000
+    
+    def __len__(self):
+        return len(self.messages)
+    
+    @classmethod
+    def synthetic(cls, size, seed=1, now=None):
+        """Deterministic mailbox: a few receipts and urgent mails among newsletters"""
+        rng = random.Random(seed)
+        now = now or time.time()
+        step = MAILBOX_YEARS * 365 * 86400 / max(size, 1)
+        messages = []
+        for i in range(size):
+            timestamp = now - i * step
+            labels = {'INBOX'}
+            if rng.random() < 0.1:
+                labels.add('UNREAD')
+            if rng.random() < 0.05:
+                labels.add('IMPORTANT')
+            if rng.random() < 0.01:
+                labels.add('STARRED')
+            filler = ' '.join(rng.choices(FILLER, k=rng.randint(3, 12)))
+            
+            kind = rng.random()
+            if kind < RECEIPT_SHARE:
+                sender, subject, amount, frequency = rng.choice(VENDOR_RECEIPTS)
+                period = 'per month' if frequency == 'monthly' else 'billed annually'
+                body = f'Thanks for your purchase. Total: ${amount:.2f} {period}. {filler}'
+            elif kind < RECEIPT_SHARE + URGENT_SHARE:
+                sender, subject = rng.choice(OTHER_SENDERS), rng.choice(URGENT_SUBJECTS)
+                labels.add('UNREAD')
+                body = filler
+            else:
+                sender, subject = rng.choice(OTHER_SENDERS), rng.choice(OTHER_SUBJECTS)
+                body = filler
+                if rng.random() < 0.2:
+                    body += f' Sale: ${rng.randint(5, 300)} off'
+            
+            messages.append(Message(f'{i:016x}', sender, subject, timestamp,
+                                    frozenset(labels), body, rng.random() < 0.3))
+        return cls(messages)
+    
+    @classmethod
+    def from_file(cls, path):
+        """Replay a mailbox saved by record_mailbox()"""
+        with open(path) as f:
+            resources = json.load(f)
+        messages = []
+        for resource in resources:
+            headers = {h['name'].lower(): h['value'] for h in resource['payload']['headers']}
+            messages.append(Message(resource['id'], headers.get('from', ''),
+                                    headers.get('subject', ''), int(resource['internalDate']) / 1000,
+                                    frozenset(resource.get('labelIds', [])),
+                                    extract_body(resource['payload']), False))
+        messages.sort(key=lambda m: m.timestamp, reverse=True)
+        return cls(messages, raw={r['id']: r for r in resources})
+    
+    def search(self, query):
+        """IDs matching a Gmail search query, newest first"""
+        ids = self._matches.get(query)
+        if ids is None:
+            predicate = compile_query(query)
+            ids = self._matches[query] = [m.id for m in self.messages if predicate(m)]
+        return ids
+    
+    def resource(self, message_id, fmt='full', metadata_headers=None):
+        """The messages.get response for one message"""
+        raw = self.raw.get(message_id)
+        if raw is not None:
+            resource = raw
+        else:
+            m = self.by_id[message_id]
+            headers = [
+                {'name': 'From', 'value': m.sender},
+                {'name': 'To', 'value': 'me@example.com'},
+                {'name': 'Subject', 'value': m.subject},
+                {'name': 'Date', 'value': formatdate(m.timestamp)},
+            ]
+            parts = [{'mimeType': 'text/html', 'filename': '',
+                      'body': {'data': _b64(f'<html><body><p>{m.body}</p></body></html>')}}]
+            if not m.html_only:
+                parts.insert(0, {'mimeType': 'text/plain', 'filename': '', 'body': {'data': _b64(m.body)}})
+            resource = {
+                'id': m.id, 'threadId': m.id, 'labelIds': sorted(m.labels),
+                'snippet': m.body[:100], 'internalDate': str(int(m.timestamp * 1000)),
+                'payload': {'mimeType': 'multipart/alternative', 'headers': headers, 'parts': parts}
+            }
+        
+        if fmt == 'full':
+            return resource
+        slim = {k: v for k, v in resource.items() if k != 'payload'}
+        if fmt == 'metadata':
+            wanted = {name.lower() for name in metadata_headers or ()}
+            headers = [h for h in resource['payload']['headers']
+                       if not wanted or h['name'].lower() in wanted]
+            slim['payload'] = {'mimeType': resource['payload']['mimeType'], 'headers': headers}
+        return slim
+
+def record_mailbox(service, message_ids, path):
+    """Save full-format messages from a real service for Mailbox.from_file()"""
+    from gmail_batch import fetch_messages
+    resources = list(fetch_messages(service, message_ids, parse=False))
+    with open(path, 'w') as f:
+        json.dump(resources, f)
+    return len(resources)
+
+# --- Gmail search syntax (the subset our queries use) -----------------------
+
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|(-)?(?:(\w+):)?("[^"]*"|\(|[^\s()"]+))')
+
+def _tokens(query):
+    pos = 0
+    while pos < len(query):
+        match = _TOKEN_RE.match(query, pos)
+        if not match or match.end() == pos:
+            break
+        pos = match.end()
+        lparen, rparen, negate, field, value = match.groups()
+        if lparen:
+            yield ('(', None, None)
+        elif rparen:
+            yield (')', None, None)
+        elif value == '(':
+            yield ('field', field, bool(negate))
+            yield ('(', None, None)
+        elif value == 'OR' and not field:
+            yield ('OR', None, None)
+        else:
+            yield ('term', field, (value.strip('"').lower(), bool(negate)))
+
+def _term(field, value):
+    if field == 'subject':
+        return lambda m: value in m.subject.lower()
+    if field == 'from':
+        return lambda m: value in m.sender.lower()
+    if field in ('is', 'label'):
+        label = {'unread': 'UNREAD', 'starred': 'STARRED'}.get(value, value.upper())
+        return lambda m: label in m.labels
+    if field in ('after', 'before'):
+        if value.isdigit():
+            cutoff = int(value)
+        else:
+            cutoff = datetime.strptime(value, '%Y/%m/%d').replace(tzinfo=timezone.utc).timestamp()
+        if field == 'after':
+            return lambda m: m.timestamp > cutoff
+        return lambda m: m.timestamp < cutoff
+    return lambda m: value in m.subject.lower() or value in m.sender.lower() or value in m.body.lower()
+
+def compile_query(query):
+    """Gmail search query -> predicate over Message"""
+    tokens = list(_tokens(query))
+    pos = 0
+    
+    def parse_or(field):
+        nonlocal pos
+        options = [parse_and(field)]
+        while pos < len(tokens) and tokens[pos][0] == 'OR':
+            pos += 1
+            options.append(parse_and(field))
+        if len(options) == 1:
+            return options[0]
+        return lambda m: any(option(m) for option in options)
+    
+    def parse_and(field):
+        nonlocal pos
+        terms = []
+        while pos < len(tokens) and tokens[pos][0] not in ('OR', ')'):
+            kind, name, arg = tokens[pos]
+            pos += 1
+            if kind == '(':
+                terms.append(parse_or(field))
+                pos += 1  # ')'
+            elif kind == 'field':
+                pos += 1  # '('
+                inner = parse_or(name)
+                pos += 1  # ')'
+                terms.append((lambda fn: lambda m: not fn(m))(inner) if arg else inner)
+            else:
+                value, negate = arg
+                fn = _term(name or field, value)
+                terms.append((lambda fn: lambda m: not fn(m))(fn) if negate else fn)
+        return lambda m: all(term(m) for term in terms)
+    
+    return parse_or(None)
+
+# --- Service objects ---------------------------------------------------------
+
+class FakeService:
+    """
+    Shared call accounting and simulated network latency. With quota
+    (units per second) calls over Gmail's per-user rate get a 429 with
+    Retry-After, and error_rate injects random 429s and 503s.
+    """
+    
+    def __init__(self, latency=0.0, quota=None, error_rate=0.0, seed=1):
+        self.latency = latency
+        self.quota = quota
+        self.error_rate = error_rate
+        self.calls = Counter()     # API method -> calls, batch parts included
+        self.rejected = Counter()  # HTTP status -> injected errors
+        self.round_trips = 0       # HTTP requests actually sent
+        self.server_seconds = 0.0  # Time the fake itself spent answering
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._tokens = quota or 0
+        self._refilled = time.monotonic()
+    
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+    
+    def _admit(self, method):
+        """Raise the error (if any) the server gives this call"""
+        with self._lock:
+            if self.error_rate and self._rng.random() < self.error_rate:
+                status = self._rng.choice([429, 503])
+                self.rejected[status] += 1
+                raise http_error(status)
+            if self.quota:
+                now = time.monotonic()
+                self._tokens = min(self.quota, self._tokens + (now - self._refilled) * self.quota)
+                self._refilled = now
+                units = QUOTA_UNITS.get(method, DEFAULT_UNITS)
+                if self._tokens < units:
+                    self.rejected[429] += 1
+                    raise http_error(429, retry_after=1)
+                self._tokens -= units
+    
+    def _serve(self, method, fn):
+        self._admit(method)
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.calls[method] += 1
+                self.server_seconds += elapsed
+    
+    def request(self, method, fn):
+        return FakeRequest(self, method, fn)
+    
+    def stats(self):
+        with self._lock:
+            return {'round_trips': self.round_trips, 'calls': dict(self.calls),
+                    'rejected': dict(self.rejected), 'server_seconds': self.server_seconds}
+
+class FakeRequest:
+    def __init__(self, service, method, fn):
+        self.service = service
+        self.method = method
+        self.fn = fn
+    
+    def execute(self, http=None, num_retries=0):
+        self.service._round_trip()
+        return self.service._serve(self.method, self.fn)
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+    
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request, callback))
+    
+    def execute(self, http=None):
+        self.service._round_trip()
+        for request_id, request, callback in self.requests:
+            try:
+                response, exception = self.service._serve(request.method, request.fn), None
+            except HttpError as e:
+                response, exception = None, e
+            (callback or self.callback)(request_id, response, exception)
+
+class FakeGmail(FakeService):
+    """users().messages().list/get/send, batches, getProfile and history().list"""
+    
+    MAX_PAGE = 500
+    
+    def __init__(self, mailbox, latency=0.0, **limits):
+        super().__init__(latency, **limits)
+        self.mailbox = mailbox
+        self.sent = []   # raw bodies of sent messages
+    
+    def users(self):
+        return self
+    
+    def messages(self):
+        return self
+    
+    def history(self):
+        return _GmailHistory(self)
+    
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+    
+    def getProfile(self, userId='me'):
+        return self.request('users.getProfile', lambda: {
+            'emailAddress': 'me@example.com', 'messagesTotal': len(self.mailbox),
+            'historyId': str(self.mailbox.history_id)})
+    
+    def list(self, userId='me', q='', maxResults=100, pageToken=None, **kwargs):
+        def fn():
+            ids = self.mailbox.search(q)
+            start = int(pageToken or 0)
+            end = start + min(maxResults or 100, self.MAX_PAGE)
+            result = {'resultSizeEstimate': len(ids)}
+            if ids[start:end]:
+                result['messages'] = [{'id': i, 'threadId': i} for i in ids[start:end]]
+            if end < len(ids):
+                result['nextPageToken'] = str(end)
+            return result
+        return self.request('messages.list', fn)
+    
+    def send(self, userId='me', body=None, **kwargs):
+        def fn():
+            if not body or not body.get('raw'):
+                raise http_error(400)
+            with self._lock:
+                self.sent.append(body['raw'])
+                message_id = f'sent{len(self.sent):06d}'
+            return {'id': message_id, 'threadId': message_id, 'labelIds': ['SENT']}
+        return self.request('messages.send', fn)
+    
+    def get(self, userId='me', id=None, format='full', metadataHeaders=None, **kwargs):
+        def fn():
+            if id not in self.mailbox.by_id:
+                raise http_error(404)
+            return self.mailbox.resource(id, format, metadataHeaders)
+        return self.request('messages.get', fn)
+
+class _GmailHistory:
+    def __init__(self, service):
+        self.service = service
+    
+    def list(self, userId='me', startHistoryId=None, **kwargs):
+        # The mailbox doesn't change during a benchmark, so there's never new history
+        mailbox = self.service.mailbox
+        return self.service.request('history.list', lambda: {'historyId': str(mailbox.history_id)})
+
+class FakeCalendar(FakeService):
+    """events().list with paging, time bounds and sync tokens"""
+    
+    MAX_PAGE = 2500
+    
+    def __init__(self, count, latency=0.0, seed=1, now=None):
+        super().__init__(latency)
+        rng = random.Random(seed)
+        now = now or time.time()
+        self.schedule = []
+        for i in range(count):
+            # Spread over two weeks back to two months ahead
+            start = now + rng.uniform(-14, 60) * 86400
+            event = {'id': f'ev{i:06d}', 'status': 'confirmed',
+                     'summary': rng.choice(['Ski patrol shift', 'Standup', 'Dentist', 'Avalanche class']),
+                     'location': rng.choice(['', 'Mt Hood Meadows', 'Zoom'])}
+            if rng.random() < 0.1:
+                day = datetime.fromtimestamp(start, timezone.utc).date().isoformat()
+                event['start'] = event['end'] = {'date': day}
+            else:
+                end = start + rng.choice([30, 60, 120, 480]) * 60
+                event['start'] = {'dateTime': self._iso(start)}
+                event['end'] = {'dateTime': self._iso(end)}
+            self.schedule.append((start, start + 86400 if 'date' in event['start'] else end, event))
+        self.schedule.sort(key=lambda pair: pair[0])
+        self.sync_token = 'sync-1'
+    
+    @staticmethod
+    def _iso(timestamp):
+        return datetime.fromtimestamp(timestamp, timezone.utc).isoformat().replace('+00:00', 'Z')
+    
+    def events(self):
+        return self
+    
+    def list(self, calendarId='primary', timeMin=None, timeMax=None, maxResults=250,
+             pageToken=None, syncToken=None, **kwargs):
+        def fn():
+            if syncToken is not None:
+                if syncToken != self.sync_token:
+                    raise http_error(410)
+                return {'items': [], 'nextSyncToken': self.sync_token}
+            
+            # Like the real API: timeMin bounds the end time, timeMax the start
+            items = [event for start, end, event in self.schedule
+                     if (timeMin is None or end > self._parse(timeMin))
+                     and (timeMax is None or start < self._parse(timeMax))]
+            start = int(pageToken or 0)
+            end = start + min(maxResults or 250, self.MAX_PAGE)
+            result = {'items': items[start:end]}
+            if end < len(items):
+                result['nextPageToken'] = str(end)
+            else:
+                result['nextSyncToken'] = self.sync_token
+            return result
+        return self.request('events.list', fn)
+    
+    @staticmethod
+    def _parse(value):
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Local stub of the Gmail and Calendar REST APIs
+Serves a FakeGmail/FakeCalendar pair from fake_google.py over real HTTP
+(keep-alive, one thread per connection) so google_async can be run and
+benchmarked end to end without touching Google.
+
+Usage:
+  python3 benchmarks/stub_server.py --size 1000 --latency 40   # prints its base URL
+  
+  from google_async import build_async_service
+  gmail = build_async_service('gmail', 'v1', None, root_url=f'{url}/gmail/v1')
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from googleapiclient.errors import HttpError
+
+# Query parameters the endpoints take as lists
+LIST_PARAMS = {'metadataHeaders', 'historyTypes', 'labelIds'}
+
+ROUTES = [
+    ('GET', re.compile(r'/gmail/v1/users/([^/]+)/messages$'),
+     lambda gmail, calendar, user: gmail.users().messages().list),
+    ('POST', re.compile(r'/gmail/v1/users/([^/]+)/messages/send$'),
+     lambda gmail, calendar, user: gmail.users().messages().send),
+    ('GET', re.compile(r'/gmail/v1/users/([^/]+)/messages/([^/]+)$'),
+     lambda gmail, calendar, user, message_id:
+         lambda **params: gmail.users().messages().get(id=message_id, **params)),
+    ('GET', re.compile(r'/gmail/v1/users/([^/]+)/history$'),
+     lambda gmail, calendar, user: gmail.users().history().list),
+    ('GET', re.compile(r'/gmail/v1/users/([^/]+)/profile$'),
+     lambda gmail, calendar, user: gmail.users().getProfile),
+    ('GET', re.compile(r'/calendar/v3/calendars/([^/]+)/events$'),
+     lambda gmail, calendar, calendar_id:
+         lambda **params: calendar.events().list(calendarId=calendar_id, **params)),
+]
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like Google's frontends
+    
+    def do_GET(self):
+        self._dispatch('GET')
+    
+    def do_POST(self):
+        self._dispatch('POST')
+    
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        params = {}
+        for name, values in parse_qs(url.query).items():
+            params[name] = values if name in LIST_PARAMS else values[-1]
+        if 'maxResults' in params:
+            params['maxResults'] = int(params['maxResults'])
+        
+        for route_method, pattern, resolve in ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                call = resolve(self.server.gmail, self.server.calendar,
+                               *(unquote(group) for group in match.groups()))
+                if body is not None:
+                    params['body'] = body
+                try:
+                    self._reply(200, call(**params).execute())
+                except HttpError as e:
+                    headers = {'Retry-After': e.resp['retry-after']} if 'retry-after' in e.resp else {}
+                    self._reply(e.resp.status, {'error': {'code': e.resp.status,
+                                                          'message': str(e)}}, headers)
+                except (AttributeError, TypeError) as e:
+                    self._reply(400, {'error': {'code': 400, 'message': str(e)}})
+                return
+        self._reply(404, {'error': {'code': 404, 'message': f'No route for {method} {url.path}'}})
+    
+    def _reply(self, status, payload, headers=None):
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+    
+    def log_message(self, format, *args):
+        pass
+
+def serve(gmail, calendar, host='127.0.0.1', port=0):
+    """Start serving in a background thread; returns (server, base URL)"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.gmail = gmail
+    server.calendar = calendar
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+def main():
+    from fake_google import Mailbox, FakeGmail, FakeCalendar
+    parser = argparse.ArgumentParser(description='Serve fake Gmail/Calendar data over HTTP')
+    parser.add_argument('--size', type=int, default=1000, help='synthetic mailbox size')
+    parser.add_argument('--latency', type=float, default=0.0, metavar='MS',
+                        help='simulated latency per request')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    
+    mailbox = Mailbox.synthetic(args.size)
+    server, url = serve(FakeGmail(mailbox, args.latency / 1000),
+                        FakeCalendar(max(10, args.size // 20), args.latency / 1000), port=args.port)
+    print(f"Serving {len(mailbox):,} messages on {url} (Ctrl-C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Local Google Calendar event index
+Keeps timed events in a JSON store kept current with Calendar syncToken
+incremental sync, with a start-time sorted index so "events in the next
+N hours" is a local bisect instead of an API listing
+"""
+
+import json
+import os
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from googleapiclient.errors import HttpError
+from instrumentation import span, incr
+from atomic_file import write_json
+
+INDEX_FILE = 'calendar-index.json'
+PAGE_SIZE = 2500
+
+# Events that ended longer ago than this are dropped from the store
+KEEP_PAST_DAYS = 1
+
+def parse_time(value):
+    """RFC 3339 dateTime -> epoch seconds"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+def load_index(path=INDEX_FILE):
+    """Load the event store and build its sorted start-time index"""
+    store = {'syncToken': None, 'events': {}}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                store = json.load(f)
+        except (OSError, ValueError):
+            pass
+    reindex(store)
+    return store
+
+def save_index(store, path=INDEX_FILE):
+    data = {'syncToken': store['syncToken'], 'events': store['events']}
+    write_json(path, data)
+
+def reindex(store):
+    """
+    Rebuild the parallel (start, id) arrays used for range queries, and
+    note the longest event so range queries know how far back an event
+    still running could have started
+    """
+    events = store['events']
+    ordered = sorted((event['start_ts'], event_id) for event_id, event in events.items())
+    store['starts'] = [start for start, _ in ordered]
+    store['ids'] = [event_id for _, event_id in ordered]
+    store['longest'] = max((event['end_ts'] - event['start_ts'] for event in events.values()), default=0)
+
+def _apply(store, event):
+    """Apply one event resource from a list/sync response"""
+    events = store['events']
+    start = event.get('start', {}).get('dateTime')
+    if event.get('status') == 'cancelled' or not start:
+        # Deleted, or all-day (which the checks skip anyway)
+        events.pop(event['id'], None)
+        return
+    end = event.get('end', {}).get('dateTime', start)
+    events[event['id']] = {
+        'summary': event.get('summary', 'No title'),
+        'start': start,
+        'start_ts': parse_time(start),
+        'end_ts': parse_time(end),
+        'location': event.get('location', ''),
+        'description': event.get('description', '')[:100]
+    }
+
+def sync(service, store, calendar_id='primary'):
+    """
+    Bring store up to date. With a saved syncToken this is one small
+    delta call; otherwise (first run, or Google expired the token with
+    410 Gone) it does a full listing.
+    """
+    sync_token = store.get('syncToken')
+    page_token = None
+    while True:
+        kwargs = {'calendarId': calendar_id, 'singleEvents': True,
+                  'maxResults': PAGE_SIZE, 'pageToken': page_token}
+        if sync_token:
+            kwargs['syncToken'] = sync_token
+        incr('api.events.list')
+        try:
+            with span('list'):
+                results = service.events().list(**kwargs).execute()
+        except HttpError as e:
+            if sync_token and getattr(e.resp, 'status', None) == 410:
+                incr('calendar.resyncs')
+                store['events'] = {}
+                sync_token = None
+                page_token = None
+                continue
+            raise
+        
+        for event in results.get('items', []):
+            _apply(store, event)
+        
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            store['syncToken'] = results.get('nextSyncToken')
+            break
+    
+    cutoff = time.time() - KEEP_PAST_DAYS * 86400
+    store['events'] = {event_id: event for event_id, event in store['events'].items()
+                       if event['end_ts'] >= cutoff}
+    reindex(store)
+    return store
+
+def events_between(store, start_ts, end_ts):
+    """Events still running at start_ts or starting before end_ts, by start time"""
+    starts = store['starts']
+    lo = bisect_left(starts, start_ts - store['longest'])
+    hi = bisect_right(starts, end_ts)
+    events = (store['events'][event_id] for event_id in store['ids'][lo:hi])
+    return [event for event in events if event['end_ts'] > start_ts]
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Fast email timestamps
+Date headers parsed once into epoch seconds. Gmail's internalDate needs
+no parsing at all; for headers, the common RFC 2822 shape is matched
+with one regex and the handful of timezones vendors use are memoized,
+with email.utils as the (cached) fallback for anything unusual
+"""
+
+import calendar
+import re
+from email.utils import parsedate_to_datetime, parsedate_tz
+from functools import lru_cache
+
+MONTHS = {name: number for number, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+
+# [Day, ]D Mon YYYY HH:MM[:SS] [zone]
+DATE_RE = re.compile(
+    r'^\s*(?:[A-Za-z]{3},?\s+)?(\d{1,2})\s+([A-Za-z]{3})[a-z]*\s+(\d{2,4})\s+'
+    r'(\d{1,2}):(\d{2})(?::(\d{2}))?(?:\.\d+)?\s*([+-]\d{4}|[A-Za-z]{1,5})?'
+)
+
+@lru_cache(maxsize=256)
+def zone_offset(zone):
+    """Seconds east of UTC for '+0530' or 'PST', or None if unknown"""
+    if not zone:
+        return 0
+    if zone[0] in '+-':
+        sign = -1 if zone[0] == '-' else 1
+        return sign * (int(zone[1:3]) * 3600 + int(zone[3:5]) * 60)
+    parsed = parsedate_tz(f'1 Jan 2000 00:00:00 {zone}')
+    return parsed[9] if parsed and parsed[9] is not None else None
+
+@lru_cache(maxsize=4096)
+def day_start(year, month, day):
+    """Epoch seconds at UTC midnight; receipts cluster on few enough days to cache"""
+    return calendar.timegm((year, month, day, 0, 0, 0))
+
+@lru_cache(maxsize=4096)
+def _parse_slow(date_str):
+    try:
+        return int(parsedate_to_datetime(date_str).timestamp())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return 0
+
+def parse_date(date_str):
+    """RFC 2822 Date header -> epoch seconds, or 0 if it can't be parsed"""
+    if not date_str:
+        return 0
+    match = DATE_RE.match(date_str)
+    if match:
+        day, month, year, hour, minute, second, zone = match.groups()
+        month = MONTHS.get(month.lower())
+        offset = zone_offset(zone.upper() if zone else None)
+        day = int(day)
+        if month and offset is not None and 1 <= day <= 31:
+            year = int(year)
+            if year < 100:
+                year += 2000 if year < 50 else 1900
+            seconds = int(hour) * 3600 + int(minute) * 60 + int(second or 0)
+            return day_start(year, month, day) + seconds - offset
+    return _parse_slow(date_str)
+
+def message_timestamp(message):
+    """
+    Epoch seconds for a Gmail API resource or a parsed message:
+    internalDate when Gmail sent it, else the stored timestamp, else the
+    Date header
+    """
+    internal = message.get('internalDate')
+    if internal:
+        return int(internal) // 1000
+    return message.get('timestamp') or parse_date(message.get('date', ''))
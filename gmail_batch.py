@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Batched Gmail message fetching
+Groups messages().get calls into Gmail HTTP batch requests and yields
+parsed messages, so scripts don't pay one round-trip per email
+"""
+
+from itertools import islice
+from googleapiclient.errors import HttpError
+from mime_walker import extract_body
+from email_dates import parse_date
+from instrumentation import span, incr, error
+from rate_limit import gmail_scheduler, is_retryable, is_network_error, retry_after
+
+# Gmail accepts up to 100 calls per batch but starts rate limiting
+# well before that, so stay at the documented sweet spot
+DEFAULT_CHUNK_SIZE = 50
+# Re-batch rounds for throttled requests before a message is given up on
+MAX_RETRIES = 5
+
+def get_header(headers, name):
+    """Return the first header value matching name (case-insensitive)"""
+    name = name.lower()
+    return next((h['value'] for h in headers if h['name'].lower() == name), '')
+
+def parse_message(msg):
+    """Flatten a Gmail API message into the fields the analyzers use"""
+    payload = msg.get('payload', {})
+    headers = payload.get('headers', [])
+    
+    # Walks nested multipart trees; decodes only the first few KB
+    with span('decode'):
+        body = extract_body(payload) if payload else ''
+    
+    date = get_header(headers, 'date')
+    internal_date = msg.get('internalDate')
+    return {
+        'id': msg.get('id', ''),
+        'subject': get_header(headers, 'subject'),
+        'sender': get_header(headers, 'from'),
+        'date': date,
+        # Epoch seconds; internalDate needs no parsing, the header is the fallback
+        'timestamp': int(internal_date) // 1000 if internal_date else parse_date(date),
+        'snippet': msg.get('snippet', ''),
+        'body': body
+    }
+
+def _get_request(service, message_id, fmt, metadata_headers):
+    kwargs = {'userId': 'me', 'id': message_id, 'format': fmt}
+    if metadata_headers:
+        kwargs['metadataHeaders'] = metadata_headers
+    return service.users().messages().get(**kwargs)
+
+def _fetch_one(service, message_id, fmt, metadata_headers, scheduler):
+    """Fetch a single message within quota, retrying transient failures"""
+    incr('api.messages.get')
+    try:
+        with span('get'):
+            return scheduler.call(
+                lambda: _get_request(service, message_id, fmt, metadata_headers).execute(),
+                'messages.get')
+    except Exception as e:
+        if not isinstance(e, HttpError) and not is_network_error(e):
+            raise
+        error('get', e)
+        return None
+
+def chunked(iterable, size):
+    """Split an iterable into lists of up to size items, lazily"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def fetch_messages(service, message_ids, chunk_size=DEFAULT_CHUNK_SIZE, fmt='full',
+                   metadata_headers=None, max_retries=MAX_RETRIES, parse=True, scheduler=None):
+    """
+    Yield messages for message_ids, fetched in HTTP batches of up to
+    chunk_size (fewer while Gmail is throttling us). Requests that are
+    throttled or hit server or network errors are re-batched after a
+    backoff, up to max_retries times; only messages that still fail, or
+    fail for good (e.g. 404), are skipped. Results come back in input
+    order. Set parse=False to get the raw API responses.
+    """
+    scheduler = scheduler or gmail_scheduler()
+    iterator = iter(message_ids)
+    while True:
+        # Batch request ids must be unique
+        chunk = list(dict.fromkeys(islice(iterator, min(chunk_size, scheduler.batch_size))))
+        if not chunk:
+            return
+        results = {}
+        pending = chunk
+        
+        for attempt in range(max_retries + 1):
+            failed = []
+            waits = []
+            
+            def callback(request_id, response, exception):
+                if exception is None:
+                    results[request_id] = response
+                elif isinstance(exception, HttpError) and not is_retryable(exception):
+                    error('get', exception)
+                else:
+                    failed.append(request_id)
+                    waits.append(retry_after(exception))
+            
+            batch = service.new_batch_http_request(callback=callback)
+            for message_id in pending:
+                batch.add(_get_request(service, message_id, fmt, metadata_headers),
+                          request_id=message_id)
+            scheduler.acquire('messages.get', len(pending))
+            incr('api.messages.get', len(pending))
+            try:
+                with span('get'), scheduler.slot():
+                    batch.execute()
+            except HttpError as e:
+                if not is_retryable(e):
+                    # The whole batch bounced; fall back to individual requests
+                    error('batch', e)
+                    for message_id in pending:
+                        if message_id not in results:
+                            msg = _fetch_one(service, message_id, fmt, metadata_headers, scheduler)
+                            if msg is not None:
+                                results[message_id] = msg
+                    break
+                failed = [m for m in pending if m not in results]
+                waits.append(retry_after(e))
+            except Exception as e:
+                if not is_network_error(e):
+                    raise
+                # Timed out or dropped mid-batch: retry whatever didn't answer
+                error('batch', e)
+                failed = [m for m in pending if m not in results]
+            
+            if not failed:
+                scheduler.succeeded()
+                break
+            wait = max((w for w in waits if w is not None), default=None)
+            scheduler.throttled(wait)
+            if attempt == max_retries:
+                incr('errors.get', len(failed))
+                break
+            incr('retries.get', len(failed))
+            scheduler.backoff(attempt, wait)
+            pending = failed
+        
+        for message_id in chunk:
+            if message_id in results:
+                yield parse_message(results[message_id]) if parse else results[message_id]
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Incremental Gmail scanning via history IDs
+Remembers the mailbox historyId after each run so the next run only has
+to look at messages added since then
+"""
+
+import json
+import os
+import time
+from googleapiclient.errors import HttpError
+from instrumentation import span, incr
+from rate_limit import gmail_scheduler
+from atomic_file import write_json
+
+STATE_FILE = 'gmail_history_state.json'
+
+# Slack for messages whose Date lags their arrival when narrowing
+# queries with after:
+AFTER_MARGIN_SECONDS = 3600
+
+def load_state(name, path=STATE_FILE):
+    """Load the saved scan state for name, or {} if there is none"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f).get(name, {})
+    except (OSError, ValueError):
+        return {}
+
+def save_state(name, state, path=STATE_FILE):
+    """Save the scan state for name, keeping other scanners' entries"""
+    all_state = {}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                all_state = json.load(f)
+        except (OSError, ValueError):
+            all_state = {}
+    all_state[name] = state
+    write_json(path, all_state, indent=2)
+
+def current_history_id(service):
+    """Return the mailbox's current historyId"""
+    incr('api.users.getProfile')
+    request = service.users().getProfile(userId='me')
+    return gmail_scheduler().call(request.execute, 'users.getProfile')['historyId']
+
+def messages_added_since(service, start_history_id):
+    """
+    Return (added, history_id): stubs for messages added since
+    start_history_id (with their labelIds) and the newest historyId.
+    Returns (None, None) when Gmail no longer has history that old and
+    the caller needs to fall back to a full scan.
+    """
+    added = []
+    seen_ids = set()
+    page_token = None
+    history_id = start_history_id
+    
+    while True:
+        incr('api.history.list')
+        try:
+            request = service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                pageToken=page_token
+            )
+            with span('history'):
+                results = gmail_scheduler().call(request.execute, 'history.list')
+        except HttpError as e:
+            if getattr(e.resp, 'status', None) == 404:
+                incr('history.expired')
+                return None, None
+            raise
+        
+        for record in results.get('history', []):
+            for item in record.get('messagesAdded', []):
+                msg = item['message']
+                if msg['id'] not in seen_ids:
+                    seen_ids.add(msg['id'])
+                    added.append(msg)
+        
+        history_id = results.get('historyId', history_id)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return added, history_id
+
+def incremental_search(service, name, search, path=STATE_FILE):
+    """
+    Run search() incrementally. search(after=None) returns message stubs
+    for the full query set; with after=<epoch seconds> it only has to
+    cover mail newer than that.
+    
+    First run (or expired history): full search, remember its results.
+    Later runs: one history.list call; if nothing arrived, reuse the
+    remembered results, otherwise only re-run the queries for new mail.
+    """
+    state = load_state(name, path)
+    started = int(time.time())
+    known_ids = state.get('messageIds', [])
+    
+    added = None
+    if state.get('historyId'):
+        added, history_id = messages_added_since(service, state['historyId'])
+    
+    if added is None:
+        # Grab the history ID first so mail arriving mid-scan isn't missed
+        history_id = current_history_id(service)
+        messages = list(search())
+    elif added:
+        after = state.get('lastRun', started) - AFTER_MARGIN_SECONDS
+        messages = list(search(after=after)) + [{'id': m} for m in known_ids]
+    else:
+        messages = [{'id': m} for m in known_ids]
+    
+    # Dedupe, keeping the order the search returned them in (new mail first)
+    unique = []
+    seen_ids = set()
+    for msg in messages:
+        if msg['id'] not in seen_ids:
+            seen_ids.add(msg['id'])
+            unique.append(msg)
+    
+    save_state(name, {
+        'historyId': history_id,
+        'lastRun': started,
+        'messageIds': [m['id'] for m in unique]
+    }, path)
+    return unique
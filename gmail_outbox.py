@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Gmail outbox
+A directory queue of emails to send. Queueing is one small atomic file
+write, with no auth or network, so alerting and digest flows can queue
+hundreds of notifications cheaply; one sender then drains the outbox
+with a single client, in batched send requests under the shared rate
+limiter, and records each message's outcome.
+
+Layout (every message is one JSON file, moved between states by rename):
+    pending/   queued, waiting to be sent
+    sending/   claimed by the running drain (one at a time, under drain.lock)
+    sent/      delivered; includes the Gmail message id
+    failed/    rejected, or possibly sent but unconfirmed; includes the error
+"""
+
+import base64
+import fcntl
+import json
+import os
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from email.mime.text import MIMEText
+from googleapiclient.errors import HttpError
+from instrumentation import span, incr, error
+from rate_limit import gmail_scheduler, is_throttle, retry_after
+from atomic_file import write_json
+
+OUTBOX_DIR = 'gmail_outbox'
+STATES = ('pending', 'sending', 'sent', 'failed')
+
+# 100 quota units per send, so a batch of 10 fits comfortably in the bucket
+SEND_BATCH = 10
+KEEP_SENT_DAYS = 7
+
+def encode_message(to, subject, body):
+    """Base64url-encoded RFC 2822 message, as messages.send wants it"""
+    message = MIMEText(body)
+    message['to'] = to
+    message['subject'] = subject
+    return base64.urlsafe_b64encode(message.as_bytes()).decode()
+
+def _path(outbox, state, message_id):
+    return os.path.join(outbox, state, f'{message_id}.json')
+
+def _setup(outbox):
+    for state in STATES:
+        os.makedirs(os.path.join(outbox, state), exist_ok=True)
+
+def enqueue(to, subject, body, outbox=OUTBOX_DIR):
+    """Queue one email; returns its outbox id"""
+    _setup(outbox)
+    # Time-ordered names, so drains go oldest first
+    message_id = f'{time.time_ns()}-{uuid.uuid4().hex[:8]}'
+    write_json(_path(outbox, 'pending', message_id), {
+        'id': message_id,
+        'to': to,
+        'subject': subject,
+        'body': body,
+        'queued': time.time(),
+        'attempts': 0
+    })
+    return message_id
+
+def _records(outbox, state):
+    directory = os.path.join(outbox, state)
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json'):
+            yield os.path.join(directory, name)
+
+def _claim(outbox, limit):
+    """Move up to limit pending messages, oldest first, into sending/"""
+    claimed = []
+    for path in _records(outbox, 'pending'):
+        message_id = os.path.basename(path)[:-len('.json')]
+        target = _path(outbox, 'sending', message_id)
+        os.rename(path, target)
+        with open(target) as f:
+            claimed.append(json.load(f))
+        if len(claimed) >= limit:
+            break
+    return claimed
+
+def _finish(outbox, record, status, **fields):
+    record.update(fields, status=status, finished=time.time())
+    write_json(_path(outbox, status, record['id']), record)
+    os.remove(_path(outbox, 'sending', record['id']))
+    incr(f'outbox.{status}')
+
+def _release(outbox, record):
+    """Back to pending for the next drain"""
+    write_json(_path(outbox, 'pending', record['id']), record)
+    os.remove(_path(outbox, 'sending', record['id']))
+
+@contextmanager
+def _drain_lock(outbox):
+    """Exclusive flock on the outbox; yields False if another drain holds it"""
+    with open(os.path.join(outbox, 'drain.lock'), 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+def _tidy(outbox):
+    """
+    Fail claims left by a drain that died mid-send and forget old sent
+    messages. Only called under the drain lock, so nothing in sending/
+    belongs to a live drain.
+    """
+    now = time.time()
+    for path in _records(outbox, 'sending'):
+        with open(path) as f:
+            record = json.load(f)
+        # It may have gone out before the crash; don't risk sending it twice
+        _finish(outbox, record, 'failed', error='Interrupted while sending; may have been sent')
+    for path in _records(outbox, 'sent'):
+        if now - os.path.getmtime(path) > KEEP_SENT_DAYS * 86400:
+            os.remove(path)
+
+def _send_batch(service, records, scheduler, results):
+    """One batched send; fills results with {id: (response, exception)} as answers arrive"""
+    
+    def callback(request_id, response, exception):
+        results[request_id] = (response, exception)
+    
+    batch = service.new_batch_http_request(callback=callback)
+    for record in records:
+        raw = encode_message(record['to'], record['subject'], record['body'])
+        batch.add(service.users().messages().send(userId='me', body={'raw': raw}),
+                  request_id=record['id'])
+    scheduler.acquire('messages.send', len(records))
+    incr('api.messages.send', len(records))
+    with span('send'), scheduler.slot():
+        batch.execute()
+
+def _send_chunk(service, outbox, chunk, scheduler, counts):
+    """
+    Send one claimed chunk and settle every record in it: sent, failed,
+    or returned for a retry if Gmail turned it away for quota. Returns
+    (throttled records, Retry-After waits).
+    """
+    results = {}
+    throttled = []
+    waits = []
+    failure = None
+    try:
+        _send_batch(service, chunk, scheduler, results)
+    except Exception as e:
+        if isinstance(e, HttpError) and is_throttle(e):
+            # The whole batch was turned away, so none of it went out
+            waits.append(retry_after(e))
+            throttled = [record for record in chunk if record['id'] not in results]
+        else:
+            # Timed out, dropped, or failed as a whole: unanswered sends may still have run
+            error('send', e)
+            failure = e
+    
+    for record in chunk:
+        record['attempts'] += 1
+        response, exception = results.get(record['id'], (None, None))
+        if response is not None:
+            _finish(outbox, record, 'sent', gmail_id=response.get('id'))
+            counts['sent'] += 1
+        elif exception is not None and is_throttle(exception):
+            throttled.append(record)
+            waits.append(retry_after(exception))
+        elif exception is not None:
+            _finish(outbox, record, 'failed', error=str(exception))
+            counts['failed'] += 1
+        elif record not in throttled:
+            _finish(outbox, record, 'failed',
+                    error=f'{failure or "No response in batch"}; may have been sent')
+            counts['failed'] += 1
+    return throttled, waits
+
+def drain(service, outbox=OUTBOX_DIR, batch_size=SEND_BATCH, limit=None, scheduler=None):
+    """
+    Send everything pending, one batch at a time, claiming each batch
+    just before it goes out. Sends Gmail rejected for quota are retried
+    with backoff, since they certainly didn't go out; other failures
+    aren't, since a send that errored may still have been delivered.
+    Only one drain runs per outbox. Returns counts of sent/failed/
+    requeued messages, or {'busy': 1} if another drain is running.
+    """
+    scheduler = scheduler or gmail_scheduler()
+    _setup(outbox)
+    counts = Counter()
+    with _drain_lock(outbox) as locked:
+        if not locked:
+            return {'busy': 1}
+        _tidy(outbox)
+        retry = []
+        claimed = 0
+        attempt = 0
+        try:
+            while True:
+                if retry:
+                    chunk, retry = retry[:batch_size], retry[batch_size:]
+                else:
+                    room = batch_size if limit is None else min(batch_size, limit - claimed)
+                    chunk = _claim(outbox, room) if room > 0 else []
+                    claimed += len(chunk)
+                if not chunk:
+                    break
+                
+                throttled, waits = _send_chunk(service, outbox, chunk, scheduler, counts)
+                if not throttled:
+                    scheduler.succeeded()
+                    attempt = 0
+                    continue
+                retry = throttled + retry
+                wait = max((w for w in waits if w is not None), default=None)
+                scheduler.throttled(wait)
+                attempt += 1
+                if attempt >= scheduler.max_attempts:
+                    break  # Quota isn't freeing up; leave the rest for the next drain
+                incr('retries.send', len(throttled))
+                scheduler.backoff(attempt - 1, wait)
+        finally:
+            # Only ever throttled, so certainly unsent: safe to send next time
+            for record in retry:
+                _release(outbox, record)
+                counts['requeued'] += 1
+    return dict(counts)
+
+def status(outbox=OUTBOX_DIR):
+    """{state: count} plus the most recent failures"""
+    _setup(outbox)
+    counts = {state: sum(1 for _ in _records(outbox, state)) for state in STATES}
+    failures = []
+    for path in list(_records(outbox, 'failed'))[-5:]:
+        with open(path) as f:
+            record = json.load(f)
+        failures.append({key: record.get(key) for key in ('id', 'to', 'subject', 'error')})
+    return {'counts': counts, 'recent_failures': failures}
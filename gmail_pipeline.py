@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Two-stage extraction pipeline
+Stage one fetches cheap metadata (headers + snippet) and applies the
+sender/subject heuristics; stage two fetches and decodes full bodies
+only for the messages that survive
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from gmail_batch import fetch_messages, parse_message, chunked, DEFAULT_CHUNK_SIZE
+from message_cache import get_cached, put_cached
+from scan_checkpoint import CHECKPOINT_EVERY
+import instrumentation
+
+METADATA_HEADERS = ['Subject', 'From', 'Date']
+
+# Messages parsed by ingest() go back into the cache this many at a time
+CACHE_BATCH = 50
+
+BILLING_WORDS = (
+    'subscription', 'receipt', 'invoice', 'billing', 'payment', 'renewal',
+    'membership', 'your plan', 'charge', 'order', 'bill', 'trial', 'premium'
+)
+
+def looks_like_billing(message):
+    """Stage-one heuristic: could this message carry a charge?"""
+    if '$' in message['subject'] or '$' in message['snippet']:
+        return True
+    text = (message['subject'] + ' ' + message['sender']).lower()
+    return any(word in text for word in BILLING_WORDS)
+
+def stream_candidates(service, message_ids, cache=None, keep=looks_like_billing,
+                      chunk_size=DEFAULT_CHUNK_SIZE, parse=True):
+    """
+    Yield full parsed messages for the message_ids that pass keep(),
+    in input order. keep() sees a parsed metadata-only message (empty
+    body). Full messages and rejected headers are both cached, so a
+    warm run makes no API calls at all.
+    
+    With parse=False, freshly fetched messages come back as raw API
+    responses (cache hits are still parsed dicts) so parsing can happen
+    elsewhere; caching those is then up to the caller.
+    """
+    seen_ids = set()
+    for chunk in chunked(message_ids, chunk_size):
+        chunk = [m for m in dict.fromkeys(chunk) if m not in seen_ids]
+        seen_ids.update(chunk)
+        
+        found = get_cached(cache, chunk) if cache is not None else {}
+        missing = [m for m in chunk if m not in found]
+        headers = {}
+        if missing and cache is not None:
+            headers = get_cached(cache, missing, table='headers')
+        
+        # Stage one: metadata for anything we've never seen
+        unseen = [m for m in missing if m not in headers]
+        if unseen:
+            fetched = list(fetch_messages(service, unseen, chunk_size=chunk_size, fmt='metadata',
+                                          metadata_headers=METADATA_HEADERS))
+            headers.update((msg['id'], msg) for msg in fetched)
+        
+        survivors = [m for m in missing if m in headers and keep(headers[m])]
+        rejected = [headers[m] for m in unseen if m in headers and m not in survivors]
+        instrumentation.incr('pipeline.rejected', len(missing) - len(survivors))
+        
+        # Stage two: full bodies for the survivors only
+        if survivors:
+            fetched = list(fetch_messages(service, survivors, chunk_size=chunk_size, parse=parse))
+            found.update((msg['id'], msg) for msg in fetched)
+            if cache is not None and parse:
+                put_cached(cache, fetched)
+        if rejected and cache is not None:
+            put_cached(cache, rejected, table='headers')
+        
+        for message_id in chunk:
+            if message_id in found:
+                yield found[message_id]
+
+def _apply(fn, items):
+    # Worker processes ship their spans back with each chunk's results
+    instrumentation.reset()
+    results = [fn(item) for item in items]
+    return results, instrumentation.snapshot()
+
+def _collect(future):
+    results, profile = future.result()
+    instrumentation.merge(profile)
+    return results
+
+def map_ordered(fn, items, workers, chunk_size=32):
+    """
+    Like map(fn, items) but fn runs on a pool of worker processes.
+    items is consumed lazily as workers free up, so the caller can keep
+    fetching while earlier items are parsed; results come back in input
+    order, identical to the serial path. fn must be a module-level
+    function so it can be pickled.
+    """
+    window = workers * 2
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk in chunked(items, chunk_size):
+            pending.append(executor.submit(_apply, fn, chunk))
+            if len(pending) >= window:
+                yield from _collect(pending.popleft())
+        while pending:
+            yield from _collect(pending.popleft())
+
+def extract_candidate(extract, item):
+    """
+    Parse (if still raw) and extract one candidate message. Returns
+    (parsed message if it was raw else None, extract(parsed message)).
+    """
+    message = parse_message(item) if 'payload' in item else None
+    return message, extract(message or item)
+
+def ingest(service, message_ids, extract, consume, cache=None, workers=0,
+           processed=0, report_every=0):
+    """
+    Fetch the candidates among message_ids, run extract() on each and
+    hand the results to consume() in input order. extract runs on
+    worker processes with workers, so it must be a module-level
+    function; messages parsed there are cached here. Returns the running
+    count of candidates, starting from processed.
+    """
+    work = partial(extract_candidate, extract)
+    if workers:
+        # Fetch on this thread, decode and extract on the pool
+        candidates = stream_candidates(service, message_ids, cache, parse=False)
+        results = map_ordered(work, candidates, workers)
+    else:
+        results = map(work, stream_candidates(service, message_ids, cache))
+    
+    parsed = []
+    for processed, (message, record) in enumerate(results, processed + 1):
+        if report_every and processed % report_every == 0:
+            print(f"   Processed {processed} emails...")
+        consume(record)
+        if message is not None and cache is not None:
+            parsed.append(message)
+            if len(parsed) >= CACHE_BATCH:
+                put_cached(cache, parsed)
+                parsed = []
+    if parsed:
+        put_cached(cache, parsed)
+    return processed
+
+def add_pipeline_arguments(parser, checkpoint_file, newest):
+    """The options every script built on ingest() shares, --profile/--trace included"""
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't read or write the local message cache")
+    parser.add_argument('--workers', type=int, default=0, metavar='N',
+                        help='parse message bodies on N worker processes')
+    parser.add_argument('--full', action='store_true',
+                        help=f'use every matching message (resumable) instead of the newest {newest}')
+    parser.add_argument('--checkpoint', default=checkpoint_file, metavar='FILE',
+                        help=f'where --full saves its progress (default {checkpoint_file})')
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY, metavar='N',
+                        help=f'save progress every N messages (default {CHECKPOINT_EVERY})')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore a saved --full checkpoint and start over')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='use the aiohttp client (google_async) instead of googleapiclient')
+    instrumentation.add_arguments(parser)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Concurrent Gmail search
+Runs a set of queries in parallel, follows nextPageToken, and yields
+unique message stubs as pages come in
+"""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from google_client import authorized_http
+from instrumentation import span, incr, error
+from rate_limit import gmail_scheduler
+
+MAX_WORKERS = 4
+PAGE_SIZE = 100
+
+# How many pages may sit unread before workers wait for the consumer
+PAGES_AHEAD = 2
+
+def thread_http(service):
+    """
+    httplib2 connections aren't thread-safe, so each worker thread gets
+    its own pooled connection. Returns None (use the service's own) when
+    the service doesn't carry credentials we can reuse.
+    """
+    credentials = getattr(getattr(service, '_http', None), 'credentials', None)
+    if credentials is None:
+        return None
+    return authorized_http(credentials)
+
+def _list_pages(service, query, max_results, page_size, scheduler):
+    """Yield successive pages of message stubs for one query"""
+    page_token = None
+    fetched = 0
+    while True:
+        limit = page_size if max_results is None else min(page_size, max_results - fetched)
+        if limit <= 0:
+            return
+        request = service.users().messages().list(
+            userId='me',
+            q=query,
+            maxResults=limit,
+            pageToken=page_token
+        )
+        incr('api.messages.list')
+        with span('list'):
+            # Retries throttled pages instead of ending the query early
+            results = scheduler.call(lambda: request.execute(http=thread_http(service)),
+                                     'messages.list')
+        messages = results.get('messages', [])
+        fetched += len(messages)
+        yield messages
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
+
+def search_messages(service, queries, max_results=None, page_size=PAGE_SIZE,
+                    max_workers=MAX_WORKERS, on_error=None, scheduler=None, ordered=False):
+    """
+    Yield unique message stubs for all queries. Queries run concurrently
+    on up to max_workers threads and follow page tokens until exhausted
+    (or max_results per query). Workers only stay a couple of pages ahead
+    of the consumer, so stopping early stops the listing too.
+    on_error(query, exception) is called for queries that fail. Requests
+    go through the shared quota scheduler, which may run fewer than
+    max_workers at once while Gmail is throttling.
+    
+    By default stubs come out in whatever order pages arrive. With
+    ordered=True they come out query by query, in order (each query's
+    pages newest first), while later queries still list in the
+    background, so callers that keep only the first N get the same N
+    every run.
+    """
+    scheduler = scheduler or gmail_scheduler()
+    pages = queue.Queue(maxsize=max_workers * PAGES_AHEAD)
+    stop = threading.Event()
+    done = object()
+    
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def worker(index, query):
+        try:
+            for page in _list_pages(service, query, max_results, page_size, scheduler):
+                if not put(('page', index, page)):
+                    return
+        except Exception as e:
+            error('list', e)
+            put(('error', index, e))
+        finally:
+            put(('done', index, done))
+    
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    for index, query in enumerate(queries):
+        executor.submit(worker, index, query)
+    
+    seen_ids = set()
+    remaining = len(queries)
+    # ordered: pages of queries after the current one wait here
+    waiting = {index: [] for index in range(len(queries))}
+    finished = set()
+    current = 0
+    
+    def unique(page):
+        for msg in page:
+            if msg['id'] not in seen_ids:
+                seen_ids.add(msg['id'])
+                yield msg
+    
+    try:
+        while remaining:
+            kind, index, payload = pages.get()
+            if kind == 'done':
+                remaining -= 1
+                finished.add(index)
+                # Release the queries that were waiting on this one
+                while ordered and current in finished:
+                    current += 1
+                    for page in waiting.pop(current, ()):
+                        yield from unique(page)
+            elif kind == 'error':
+                if on_error:
+                    on_error(queries[index], payload)
+            elif not ordered or index == current:
+                yield from unique(payload)
+            else:
+                waiting[index].append(payload)
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -4,108 +4,77 @@ Gmail Subscription Scanner
 Finds all your subscription emails and extracts payment info
 """
 
-import os.path
-import pickle
 import re
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from collections import defaultdict
-import base64
+from datetime import datetime
+from functools import partial
+from itertools import islice
+import argparse
+from google_client import get_service
+from gmail_search import search_messages
+from gmail_history import incremental_search
+from message_cache import open_cache, get_message
+from message_index import indexed_search
+from gmail_pipeline import ingest, add_pipeline_arguments
+from subscription_classifier import find_amounts
+from email_dates import message_timestamp
+from instrumentation import span, error, report_at_exit
+from scan_checkpoint import run_segments
 
 # Gmail API scopes - we only need read access
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+CHECKPOINT_FILE = 'gmail_subscription_scanner_checkpoint.json'
 
-def authenticate():
+QUERIES = [
+    'subject:(subscription OR billing OR payment OR invoice OR receipt)',
+    'from:(noreply OR billing OR subscriptions OR payments)',
+    'subject:"your subscription"',
+    'subject:"monthly payment"',
+    'subject:"your bill"'
+]
+
+def authenticate(use_async=False):
     """Handles OAuth authentication and returns Gmail service"""
-    creds = None
-    token_file = 'gmail_token.pickle'
-    
-    # Load saved token if exists
-    if os.path.exists(token_file):
-        with open(token_file, 'rb') as token:
-            creds = pickle.load(token)
-    
-    # If no valid credentials, do OAuth flow
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            print("Refreshing expired token...")
-            creds.refresh(Request())
-        else:
-            print("\n🔐 Opening browser for Gmail authorization...")
-            print("Please authorize access to your Gmail (read-only)\n")
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'gmail_credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        
-        # Save the token for next time
-        with open(token_file, 'wb') as token:
-            pickle.dump(creds, token)
-        print("✅ Authentication successful!\n")
-    
-    return build('gmail', 'v1', credentials=creds)
+    return get_service('gmail', 'v1', token_file='gmail_token.pickle', scopes=SCOPES,
+                       credentials_file='gmail_credentials.json', use_async=use_async)
 
-def search_subscription_emails(service, max_results=500):
-    """Search for subscription-related emails"""
-    queries = [
-        'subject:(subscription OR billing OR payment OR invoice OR receipt)',
-        'from:(noreply OR billing OR subscriptions OR payments)',
-        'subject:"your subscription"',
-        'subject:"monthly payment"',
-        'subject:"your bill"'
-    ]
-    
-    all_messages = []
-    seen_ids = set()
+def search_subscription_emails(service, max_results=500, after=None, ordered=True):
+    """
+    Search for subscription-related emails, optionally only newer than
+    after (epoch seconds). Yields message stubs as results stream in,
+    query by query unless ordered=False (fine when every result is used).
+    """
+    queries = QUERIES
+    if after:
+        queries = [f'({query}) after:{int(after)}' for query in queries]
     
     print("🔍 Scanning your Gmail for subscription emails...")
     
-    for query in queries:
-        try:
-            results = service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=max_results
-            ).execute()
-            
-            messages = results.get('messages', [])
-            for msg in messages:
-                if msg['id'] not in seen_ids:
-                    all_messages.append(msg)
-                    seen_ids.add(msg['id'])
-        except Exception as e:
-            print(f"Error searching: {e}")
+    def report_error(query, e):
+        print(f"Error searching: {e}")
     
-    print(f"📧 Found {len(all_messages)} subscription-related emails\n")
-    return all_messages[:max_results]
+    # Queries run concurrently; pages are yielded as soon as their turn comes
+    yield from islice(search_messages(service, queries, on_error=report_error, ordered=ordered),
+                      max_results)
 
-def extract_subscription_info(service, message_id):
+def extract_subscription_info(service, message_id, cache=None):
     """Extract subscription details from an email"""
     try:
-        msg = service.users().messages().get(
-            userId='me', 
-            id=message_id,
-            format='full'
-        ).execute()
-        
-        headers = msg['payload']['headers']
-        subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), '')
-        sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), '')
-        date = next((h['value'] for h in headers if h['name'].lower() == 'date'), '')
-        
-        # Get email body
-        body = ''
-        if 'parts' in msg['payload']:
-            for part in msg['payload']['parts']:
-                if part['mimeType'] == 'text/plain' and 'data' in part['body']:
-                    body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
-                    break
-        elif 'body' in msg['payload'] and 'data' in msg['payload']['body']:
-            body = base64.urlsafe_b64decode(msg['payload']['body']['data']).decode('utf-8', errors='ignore')
+        return parse_subscription_info(get_message(service, message_id, cache))
+    except Exception as e:
+        error('extract', e)
+        return None
+
+def parse_subscription_info(message):
+    """Extract subscription details from a parsed message"""
+    try:
+        subject = message['subject']
+        sender = message['sender']
+        date = message['date']
+        body = message['body']
         
         # Extract amounts (look for $X.XX or $X,XXX.XX patterns)
-        amounts = re.findall(r'\$\d+(?:,\d{3})*(?:\.\d{2})?', subject + ' ' + body)
+        with span('classify'):
+            amounts = find_amounts(subject + ' ' + body)
         
         # Extract company name from sender
         company = sender.split('@')[-1].split('.')[0] if '@' in sender else sender
@@ -116,60 +85,136 @@ def extract_subscription_info(service, message_id):
             'subject': subject[:100],
             'sender': sender[:50],
             'date': date[:30],
+            'timestamp': message_timestamp(message),
             'amounts': list(set(amounts))[:3]  # Get unique amounts
         }
     except Exception as e:
+        error('classify', e)
         return None
 
-def main():
-    print("\n" + "="*60)
-    print("  📬 Gmail Subscription Scanner")
-    print("="*60 + "\n")
-    
-    # Authenticate
-    service = authenticate()
-    
-    # Search for subscription emails
-    messages = search_subscription_emails(service)
-    
-    if not messages:
-        print("❌ No subscription emails found!")
+def add_info(subscriptions, info):
+    """Fold one parse_subscription_info() record into its company's summary"""
+    if not info or not info['amounts']:
         return
+    summary = subscriptions.get(info['company'])
+    if summary is None:
+        summary = subscriptions[info['company']] = {'last_seen': -1, 'amounts': set()}
+    if info['timestamp'] > summary.get('last_seen', 0):
+        summary.update(subject=info['subject'], sender=info['sender'],
+                       last_seen=info['timestamp'])
+    summary['amounts'].update(info['amounts'])
+
+def scan_messages(service, message_ids, subscriptions, cache=None, workers=0,
+                  processed=0, report_every=10):
+    """
+    Fetch message_ids and fold their amounts into subscriptions
+    ({company: {'subject', 'sender', 'last_seen', 'amounts'}}). Per
+    company we keep the latest email's subject/sender plus every amount
+    seen, rather than holding on to every parsed email. Returns the
+    running count of candidates scanned.
+    """
+    return ingest(service, message_ids, parse_subscription_info, partial(add_info, subscriptions),
+                  cache, workers, processed, report_every)
+
+def full_scan(service, messages, cache, args):
+    """
+    Scan every search result, checkpointing every few hundred messages
+    so an interrupted scan resumes where it stopped
+    """
+    subscriptions = {}
+    processed = 0
     
-    # Extract info from messages
-    print("📊 Analyzing subscription emails...\n")
-    subscriptions = defaultdict(list)
+    def process(segment):
+        nonlocal processed
+        processed = scan_messages(service, segment, subscriptions, cache, args.workers,
+                                  processed, report_every=0)
     
-    for i, msg in enumerate(messages[:100], 1):  # Process first 100
-        if i % 10 == 0:
-            print(f"   Processed {i}/{min(100, len(messages))} emails...")
-        
-        info = extract_subscription_info(service, msg['id'])
-        if info and info['amounts']:
-            subscriptions[info['company']].append(info)
+    def save():
+        saved = {company: dict(summary, amounts=sorted(summary['amounts']))
+                 for company, summary in subscriptions.items()}
+        return {'subscriptions': saved, 'processed': processed}
+    
+    def restore(state):
+        nonlocal processed
+        for company, summary in state['subscriptions'].items():
+            subscriptions[company] = dict(summary, amounts=set(summary['amounts']))
+        processed = state['processed']
     
-    # Display results
+    run_segments(args, messages, process, save, restore)
+    return subscriptions, processed
+
+def print_summary(subscriptions):
+    """Print each company's amounts and latest billing email"""
     print("\n" + "="*60)
     print("  💳 SUBSCRIPTION SUMMARY")
     print("="*60 + "\n")
     
-    for company, emails in sorted(subscriptions.items()):
-        amounts = []
-        for email in emails:
-            amounts.extend(email['amounts'])
-        
-        if amounts:
-            print(f"📌 {company.upper()}")
-            unique_amounts = list(set(amounts))[:3]
-            print(f"   Amount(s): {', '.join(unique_amounts)}")
-            print(f"   Last email: {emails[0]['subject'][:60]}...")
-            print(f"   From: {emails[0]['sender'][:50]}")
-            print()
+    for company, summary in sorted(subscriptions.items()):
+        print(f"📌 {company.upper()}")
+        unique_amounts = list(summary['amounts'])[:3]
+        print(f"   Amount(s): {', '.join(unique_amounts)}")
+        last_seen = summary.get('last_seen', 0)
+        when = f" ({datetime.fromtimestamp(last_seen):%Y-%m-%d})" if last_seen > 0 else ''
+        print(f"   Last email: {summary['subject'][:60]}...{when}")
+        print(f"   From: {summary['sender'][:50]}")
+        print()
     
     print("="*60)
     print(f"\n✅ Found {len(subscriptions)} companies with billing emails")
     print("\nNote: This searches your Purchases folder and subscription emails.")
     print("Some subscriptions might not appear if they use different wording.\n")
 
+def main():
+    parser = argparse.ArgumentParser(description='Gmail Subscription Scanner')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only search mail added since the last --incremental run')
+    parser.add_argument('--local', action='store_true',
+                        help='answer the queries from the local message index; '
+                             'only search Gmail for new mail')
+    add_pipeline_arguments(parser, CHECKPOINT_FILE, 100)
+    args = parser.parse_args()
+    if args.full and args.incremental:
+        parser.error('--full and --incremental are mutually exclusive')
+    if args.local and (args.incremental or args.no_cache):
+        parser.error('--local needs the message cache and replaces --incremental')
+    report_at_exit('gmail_subscription_scanner', args.profile, args.trace)
+    
+    print("\n" + "="*60)
+    print("  📬 Gmail Subscription Scanner")
+    print("="*60 + "\n")
+    
+    # Authenticate
+    service = authenticate(args.use_async)
+    cache = None if args.no_cache else open_cache()
+    
+    # Search for subscription emails
+    if args.local:
+        messages = indexed_search(
+            service, 'gmail_subscription_scanner_local', QUERIES,
+            lambda after=None: search_subscription_emails(service, max_results=None, after=after),
+            cache)
+    elif args.incremental:
+        messages = incremental_search(
+            service, 'gmail_subscription_scanner',
+            lambda after=None: search_subscription_emails(service, after=after))
+    else:
+        messages = search_subscription_emails(service, max_results=None if args.full else 500,
+                                              ordered=not args.full)
+    
+    # Extract info from messages as soon as the first search page arrives
+    print("📊 Analyzing subscription emails...\n")
+    if args.full:
+        subscriptions, processed = full_scan(service, messages, cache, args)
+    else:
+        subscriptions = {}
+        message_ids = (msg['id'] for msg in islice(messages, 100))  # Process first 100
+        processed = scan_messages(service, message_ids, subscriptions, cache, args.workers)
+    
+    if not processed:
+        print("❌ No subscription emails found!")
+        return
+    print(f"\n📧 Analyzed {processed} subscription-related emails")
+    print_summary(subscriptions)
+
 if __name__ == '__main__':
     main()
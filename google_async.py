@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Async Gmail/Calendar REST client
+Speaks just the endpoints these scripts use (messages list/get/send,
+history.list, getProfile and events.list) over one pooled keep-alive
+aiohttp session, instead of building googleapiclient's discovery object
+tree. Requests run on a background event loop, so concurrent callers
+and batches overlap their I/O.
+
+The services it returns mimic the googleapiclient resources we call
+(service.users().messages().get(...).execute(), new_batch_http_request),
+so the rest of the code, including the rate limiter and retries, works
+unchanged. aiohttp is optional and only imported when this is used.
+"""
+
+import asyncio
+import atexit
+import json
+import threading
+from urllib.parse import quote
+import httplib2
+from googleapiclient.errors import HttpError
+from instrumentation import span, incr
+
+GMAIL_URL = 'https://gmail.googleapis.com/gmail/v1'
+CALENDAR_URL = 'https://www.googleapis.com/calendar/v3'
+HTTP_TIMEOUT = 60
+MAX_CONNECTIONS = 16
+
+class AsyncTransport:
+    """An event loop thread plus an aiohttp session, shared by every request on it"""
+    
+    def __init__(self, creds, max_connections=MAX_CONNECTIONS, timeout=HTTP_TIMEOUT):
+        self.creds = creds
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+        self._refresh_lock = None
+        thread = threading.Thread(target=self.loop.run_forever, name='google-async', daemon=True)
+        thread.start()
+        atexit.register(self.close)
+    
+    def run(self, coro):
+        """Run coro on the transport's loop and wait for its result (from any thread)"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+    
+    def close(self):
+        if self.loop.is_closed():
+            return
+        if self.session is not None:
+            self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+    
+    async def _session(self):
+        if self.session is None:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self.session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._refresh_lock = asyncio.Lock()
+        return self.session
+    
+    async def _authorization(self, force=False):
+        """Bearer header, refreshing the token off-loop (once, however many requests wait)"""
+        if self.creds is None:
+            return {}
+        if force or not self.creds.valid:
+            async with self._refresh_lock:
+                if force or not self.creds.valid:
+                    # Through the shared token store, so other processes reuse it
+                    from google_client import refresh_credentials
+                    await self.loop.run_in_executor(None, refresh_credentials, self.creds, force)
+        return {'Authorization': f'Bearer {self.creds.token}'}
+    
+    async def request(self, method, url, params=None, body=None):
+        """One API call; returns the decoded JSON, raises HttpError for error statuses"""
+        session = await self._session()
+        data = json.dumps(body).encode() if body is not None else None
+        query = _query(params or {})
+        for attempt in range(2):
+            headers = await self._authorization(force=attempt > 0)
+            if data is not None:
+                headers['Content-Type'] = 'application/json'
+            with span('http'):
+                async with session.request(method, url, params=query, data=data,
+                                           headers=headers) as response:
+                    content = await response.read()
+            incr('http.requests')
+            incr('http.bytes_sent', len(data or b''))
+            incr('http.bytes_received', len(content))
+            # A token revoked or expired early gets one refresh and retry
+            if response.status != 401 or self.creds is None:
+                break
+        if response.status >= 400:
+            incr(f'http.status_{response.status}')
+            resp = httplib2.Response(dict(response.headers, status=str(response.status)))
+            resp.reason = response.reason
+            raise HttpError(resp, content, uri=str(response.url))
+        return json.loads(content) if content else {}
+
+def _query(params):
+    """Query string pairs: None dropped, lists repeated, booleans lowercased"""
+    pairs = []
+    for name, value in params.items():
+        if value is None:
+            continue
+        for item in value if isinstance(value, (list, tuple)) else [value]:
+            pairs.append((name, str(item).lower() if isinstance(item, bool) else str(item)))
+    return pairs
+
+class AsyncRequest:
+    """Deferred call with the googleapiclient HttpRequest surface we use"""
+    
+    def __init__(self, transport, method, url, params=None, body=None):
+        self.transport = transport
+        self.method = method
+        self.url = url
+        self.params = params
+        self.body = body
+    
+    def coroutine(self):
+        return self.transport.request(self.method, self.url, self.params, self.body)
+    
+    def execute(self, http=None, num_retries=0):
+        # http is googleapiclient's per-thread connection; the session is already shared
+        return self.transport.run(self.coroutine())
+
+class AsyncBatch:
+    """new_batch_http_request() stand-in: the calls run concurrently instead of in one POST"""
+    
+    def __init__(self, transport, callback=None):
+        self.transport = transport
+        self.callback = callback
+        self.requests = []
+    
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id or str(len(self.requests) + 1)
+        self.requests.append((request_id, request, callback or self.callback))
+    
+    async def _gather(self):
+        return await asyncio.gather(*(request.coroutine() for _, request, _ in self.requests),
+                                    return_exceptions=True)
+    
+    def execute(self, http=None):
+        results = self.transport.run(self._gather())
+        for (request_id, _, callback), result in zip(self.requests, results):
+            if callback is None:
+                continue
+            if isinstance(result, HttpError):
+                callback(request_id, None, result)
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                callback(request_id, result, None)
+
+class AsyncGmail:
+    """users().messages()/history()/getProfile() and batches, for userId='me' style calls"""
+    
+    def __init__(self, transport, root_url=GMAIL_URL):
+        self.transport = transport
+        self.root_url = root_url.rstrip('/')
+    
+    def users(self):
+        return self
+    
+    def messages(self):
+        return _Messages(self)
+    
+    def history(self):
+        return _History(self)
+    
+    def _url(self, user_id, path):
+        return f'{self.root_url}/users/{quote(user_id)}/{path}'
+    
+    def getProfile(self, userId):
+        return AsyncRequest(self.transport, 'GET', self._url(userId, 'profile'))
+    
+    def new_batch_http_request(self, callback=None):
+        return AsyncBatch(self.transport, callback)
+
+class _Messages:
+    def __init__(self, gmail):
+        self.gmail = gmail
+    
+    def list(self, userId, q=None, maxResults=None, pageToken=None, labelIds=None,
+             includeSpamTrash=None):
+        params = {'q': q, 'maxResults': maxResults, 'pageToken': pageToken,
+                  'labelIds': labelIds, 'includeSpamTrash': includeSpamTrash}
+        return AsyncRequest(self.gmail.transport, 'GET', self.gmail._url(userId, 'messages'), params)
+    
+    def get(self, userId, id, format=None, metadataHeaders=None):
+        params = {'format': format, 'metadataHeaders': metadataHeaders}
+        url = self.gmail._url(userId, f'messages/{quote(id)}')
+        return AsyncRequest(self.gmail.transport, 'GET', url, params)
+    
+    def send(self, userId, body):
+        url = self.gmail._url(userId, 'messages/send')
+        return AsyncRequest(self.gmail.transport, 'POST', url, body=body)
+
+class _History:
+    def __init__(self, gmail):
+        self.gmail = gmail
+    
+    def list(self, userId, startHistoryId, historyTypes=None, pageToken=None, labelId=None,
+             maxResults=None):
+        params = {'startHistoryId': startHistoryId, 'historyTypes': historyTypes,
+                  'pageToken': pageToken, 'labelId': labelId, 'maxResults': maxResults}
+        return AsyncRequest(self.gmail.transport, 'GET', self.gmail._url(userId, 'history'), params)
+
+class AsyncCalendar:
+    """events().list() with the query parameters calendar_index passes"""
+    
+    def __init__(self, transport, root_url=CALENDAR_URL):
+        self.transport = transport
+        self.root_url = root_url.rstrip('/')
+    
+    def events(self):
+        return self
+    
+    def list(self, calendarId, **params):
+        url = f'{self.root_url}/calendars/{quote(calendarId)}/events'
+        return AsyncRequest(self.transport, 'GET', url, params)
+    
+    def new_batch_http_request(self, callback=None):
+        return AsyncBatch(self.transport, callback)
+
+SERVICES = {
+    ('gmail', 'v1'): (AsyncGmail, GMAIL_URL),
+    ('calendar', 'v3'): (AsyncCalendar, CALENDAR_URL),
+}
+
+_transports = {}    # id(creds) -> transport
+_transports_lock = threading.Lock()
+
+def build_async_service(api, version, creds, root_url=None):
+    """Async-backed stand-in for googleapiclient's build(api, version)"""
+    if (api, version) not in SERVICES:
+        raise ValueError(f"No async client for {api} {version}")
+    with _transports_lock:
+        transport = _transports.get(id(creds))
+        if transport is None:
+            transport = _transports[id(creds)] = AsyncTransport(creds)
+    cls, default_url = SERVICES[(api, version)]
+    return cls(transport, root_url or default_url)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Shared Google API client factory
+Loads OAuth tokens once per process (refreshed through the shared
+token_store), builds services from a discovery document cached on disk,
+and reuses pooled keep-alive HTTP connections across every call in the
+process
+"""
+
+import os
+import sys
+import threading
+import httplib2
+import google_auth_httplib2
+from google_auth_oauthlib.flow import InstalledAppFlow
+from instrumentation import span, incr, error
+from token_store import token_store, needs_refresh
+from atomic_file import write_json
+
+WORKSPACE = os.path.dirname(os.path.abspath(__file__))
+DISCOVERY_DIR = os.path.join(WORKSPACE, 'discovery_cache')
+HTTP_TIMEOUT = 60
+
+_credentials = {}   # token file -> credentials
+_stores = {}        # id(credentials) -> their TokenStore
+_services = {}      # (api, version, token file) -> service
+_local = threading.local()
+
+class CountingHttp(httplib2.Http):
+    """httplib2.Http that records every request's time and size"""
+    
+    def request(self, uri, method='GET', body=None, headers=None, *args, **kwargs):
+        with span('http'):
+            response, content = super().request(uri, method, body, headers, *args, **kwargs)
+        incr('http.requests')
+        incr('http.bytes_sent', len(body or b''))
+        incr('http.bytes_received', len(content or b''))
+        if response.status >= 400:
+            incr(f'http.status_{response.status}')
+        return response, content
+
+def load_credentials(token_file, scopes=None, credentials_file=None, interactive=True, port=0):
+    """
+    Return valid credentials for token_file, refreshing or (if
+    interactive) running the browser OAuth flow as needed. Credentials
+    are cached for the life of the process and kept fresh in the
+    background from then on.
+    """
+    store = token_store(token_file)
+    creds = _credentials.get(token_file) or store.load()
+    
+    if creds and creds.refresh_token and needs_refresh(creds, store.margin):
+        # Single-flight across processes; may just adopt another's refresh
+        store.refresh(creds)
+    elif not creds or not creds.valid:
+        if interactive:
+            print("\n🔐 Opening browser for Google authorization...", file=sys.stderr)
+            flow = InstalledAppFlow.from_client_secrets_file(credentials_file, scopes)
+            with span('auth'):
+                creds = flow.run_local_server(port=port)
+            store.save(creds)
+        else:
+            raise RuntimeError("Not authenticated. Run: python3 skills/gmail-auth.py")
+    
+    _credentials[token_file] = creds
+    _stores[id(creds)] = store
+    store.keep_fresh(creds)
+    return creds
+
+def refresh_credentials(creds, force=False):
+    """Refresh creds through their token store (e.g. after a 401)"""
+    store = _stores.get(id(creds))
+    if store is None:
+        from google.auth.transport.requests import Request
+        creds.refresh(Request())
+        return creds
+    return store.refresh(creds, force=force)
+
+def authorized_http(creds):
+    """
+    A keep-alive HTTP connection pool for creds, one per thread since
+    httplib2 isn't thread-safe. Reused for every request on that thread.
+    """
+    pools = getattr(_local, 'pools', None)
+    if pools is None:
+        pools = _local.pools = {}
+    http = pools.get(id(creds))
+    if http is None:
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=CountingHttp(timeout=HTTP_TIMEOUT))
+        pools[id(creds)] = http
+    return http
+
+def _discovery_path(api, version):
+    return os.path.join(DISCOVERY_DIR, f'{api}.{version}.json')
+
+def build_service(api, version, creds):
+    """Build an API client, using the on-disk discovery document when we have one"""
+    # Imported here so --async runs never load the discovery machinery
+    from googleapiclient.discovery import build, build_from_document
+    http = authorized_http(creds)
+    path = _discovery_path(api, version)
+    if os.path.exists(path):
+        with open(path) as f:
+            return build_from_document(f.read(), http=http)
+    
+    service = build(api, version, http=http, cache_discovery=False)
+    try:
+        os.makedirs(DISCOVERY_DIR, exist_ok=True)
+        write_json(path, service._rootDesc)
+    except OSError as e:
+        error('discovery_cache', e)  # Just slower next time
+    return service
+
+def get_service(api, version, token_file, scopes=None, credentials_file=None,
+                interactive=True, port=0, use_async=False):
+    """
+    Ready-to-use service for api/version, built at most once per process.
+    use_async swaps in the aiohttp-based client from google_async.
+    """
+    key = (api, version, token_file, use_async)
+    service = _services.get(key)
+    if service is None:
+        creds = load_credentials(token_file, scopes, credentials_file, interactive, port)
+        with span('build'):
+            if use_async:
+                from google_async import build_async_service
+                service = _services[key] = build_async_service(api, version, creds)
+            else:
+                service = _services[key] = build_service(api, version, creds)
+    return service
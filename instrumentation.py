@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Lightweight run instrumentation
+Process-wide timing spans and counters for the hot paths (auth, list,
+get, decode, classify, HTTP), an optional --profile table and a JSON
+trace file that scheduled runs append to for trend tracking
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+_lock = threading.Lock()
+_spans = {}        # name -> [count, total seconds, max seconds]
+_counters = {}     # name -> int
+_errors = {}       # where -> last error message
+_started = time.time()
+
+class _Span:
+    __slots__ = ('name', 'start')
+    
+    def __init__(self, name):
+        self.name = name
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        with _lock:
+            stats = _spans.get(self.name)
+            if stats is None:
+                _spans[self.name] = [1, elapsed, elapsed]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]:
+                    stats[2] = elapsed
+        return False
+
+def span(name):
+    """Context manager timing one occurrence of stage name"""
+    return _Span(name)
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def error(where, exc):
+    """Count an error that's being handled (or swallowed) at where"""
+    with _lock:
+        _counters[f'errors.{where}'] = _counters.get(f'errors.{where}', 0) + 1
+        _errors[where] = f'{type(exc).__name__}: {exc}'[:200]
+
+def snapshot():
+    """Everything recorded so far, JSON-ready"""
+    with _lock:
+        return {
+            'started': _started,
+            'seconds': round(time.time() - _started, 3),
+            'spans': {name: {'count': count, 'seconds': round(total, 6), 'max': round(worst, 6)}
+                      for name, (count, total, worst) in _spans.items()},
+            'counters': dict(_counters),
+            'errors': dict(_errors)
+        }
+
+def merge(data):
+    """Fold in a snapshot() taken elsewhere, e.g. in a worker process"""
+    with _lock:
+        for name, stats in data['spans'].items():
+            mine = _spans.get(name)
+            if mine is None:
+                _spans[name] = [stats['count'], stats['seconds'], stats['max']]
+            else:
+                mine[0] += stats['count']
+                mine[1] += stats['seconds']
+                mine[2] = max(mine[2], stats['max'])
+        for name, value in data['counters'].items():
+            _counters[name] = _counters.get(name, 0) + value
+        _errors.update(data['errors'])
+
+def reset():
+    global _started
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _errors.clear()
+        _started = time.time()
+
+def _format_count(name, value):
+    if name.endswith('bytes') or '.bytes_' in name:
+        return f'{value / 1e6:.2f} MB' if value >= 1e5 else f'{value / 1e3:.1f} KB'
+    return f'{value:,}'
+
+def format_profile(data=None):
+    """Human-readable table of spans, counters and errors"""
+    data = data or snapshot()
+    lines = [f"⏱️  Profile ({data['seconds']:.2f}s wall)",
+             f"  {'stage':22} {'calls':>8} {'total':>10} {'avg':>10} {'max':>10}"]
+    for name, stats in sorted(data['spans'].items(), key=lambda item: -item[1]['seconds']):
+        avg = stats['seconds'] / stats['count']
+        lines.append(f"  {name:22} {stats['count']:>8,} {stats['seconds']:>9.3f}s "
+                     f"{avg * 1000:>8.2f}ms {stats['max'] * 1000:>8.2f}ms")
+    if data['counters']:
+        lines.append('  ' + '-' * 64)
+        for name, value in sorted(data['counters'].items()):
+            lines.append(f"  {name:32} {_format_count(name, value):>14}")
+    for where, message in sorted(data['errors'].items()):
+        lines.append(f"  ⚠️  last {where} error: {message}")
+    return '\n'.join(lines)
+
+def append_trace(path, label, extra=None, clear=False, max_bytes=None):
+    """
+    Append one JSON line describing this run (or, with clear=True, the
+    activity since the last clear) to path. With max_bytes, a trace that
+    has grown past it is rotated to path.1 first, replacing the old one.
+    """
+    record = dict(snapshot(), label=label, time=int(time.time()))
+    if extra:
+        record.update(extra)
+    if clear:
+        reset()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if max_bytes and os.path.exists(path) and os.path.getsize(path) > max_bytes:
+        os.replace(path, path + '.1')
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    return record
+
+def add_arguments(parser):
+    """The shared --profile / --trace options"""
+    parser.add_argument('--profile', action='store_true',
+                        help='print a timing and API-call summary to stderr when done')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='append a JSON trace of this run to FILE')
+
+def report_at_exit(label, profile=False, trace=None):
+    """Print the profile and/or append the trace however the script exits"""
+    def report():
+        if trace:
+            append_trace(trace, label)
+        if profile:
+            print('\n' + format_profile(), file=sys.stderr)
+    if profile or trace:
+        atexit.register(report)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Local Gmail message cache
+Gmail messages never change once delivered, so parsed headers and bodies
+are kept in SQLite keyed by message ID and reused across runs
+"""
+
+import sqlite3
+import time
+from gmail_batch import parse_message
+from instrumentation import incr
+from rate_limit import gmail_scheduler
+
+CACHE_FILE = 'gmail_message_cache.sqlite'
+MAX_CACHE_BYTES = 64 * 1024 * 1024  # Evict least recently used past this
+
+FIELDS = ('id', 'subject', 'sender', 'date', 'timestamp', 'snippet', 'body')
+TEXT_FIELDS = ('id', 'subject', 'sender', 'date', 'snippet', 'body')
+
+# messages holds full parsed messages; headers holds metadata-only
+# records for candidates the early filter rejected (body is empty)
+TABLES = ('messages', 'headers')
+
+def open_cache(path=CACHE_FILE):
+    """Open (and create if needed) the message cache database"""
+    conn = sqlite3.connect(path)
+    for table in TABLES:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id TEXT PRIMARY KEY,
+                subject TEXT,
+                sender TEXT,
+                date TEXT,
+                timestamp INTEGER DEFAULT 0,
+                snippet TEXT,
+                body TEXT,
+                size INTEGER,
+                accessed REAL
+            )
+        ''')
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if 'timestamp' not in columns:
+            # Caches from before the timestamp column; old rows read as 0
+            # and get their Date header parsed on use
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN timestamp INTEGER DEFAULT 0')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)')
+    return conn
+
+def get_cached(conn, message_ids, table='messages'):
+    """Return {id: parsed message} for the IDs already in the cache"""
+    found = {}
+    message_ids = list(message_ids)
+    # Stay well under SQLite's bound-parameter limit
+    for start in range(0, len(message_ids), 500):
+        chunk = message_ids[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(
+            f'SELECT {", ".join(FIELDS)} FROM {table} WHERE id IN ({placeholders})',
+            chunk
+        ).fetchall()
+        for row in rows:
+            found[row[0]] = dict(zip(FIELDS, row))
+    incr(f'cache.{table}.hits', len(found))
+    incr(f'cache.{table}.misses', len(message_ids) - len(found))
+    if found:
+        now = time.time()
+        conn.executemany(f'UPDATE {table} SET accessed = ? WHERE id = ?',
+                         [(now, message_id) for message_id in found])
+        conn.commit()
+    return found
+
+def put_cached(conn, messages, max_bytes=MAX_CACHE_BYTES, table='messages'):
+    """Store parsed messages and evict the stalest ones if over max_bytes"""
+    now = time.time()
+    rows = []
+    for msg in messages:
+        values = [msg.get(field, '') for field in FIELDS]
+        values[FIELDS.index('timestamp')] = msg.get('timestamp') or 0
+        size = sum(len(msg.get(field, '')) for field in TEXT_FIELDS)
+        rows.append(values + [size, now])
+    if not rows:
+        return
+    conn.executemany(
+        f'INSERT OR REPLACE INTO {table} ({", ".join(FIELDS)}, size, accessed) '
+        f'VALUES ({",".join("?" * (len(FIELDS) + 2))})',
+        rows
+    )
+    evict(conn, max_bytes, table)
+    conn.commit()
+
+def evict(conn, max_bytes=MAX_CACHE_BYTES, table='messages'):
+    """Drop least recently used messages until the table fits in max_bytes"""
+    total = conn.execute(f'SELECT COALESCE(SUM(size), 0) FROM {table}').fetchone()[0]
+    if total <= max_bytes:
+        return
+    excess = total - max_bytes
+    doomed = []
+    for message_id, size in conn.execute(f'SELECT id, size FROM {table} ORDER BY accessed'):
+        doomed.append((message_id,))
+        excess -= size
+        if excess <= 0:
+            break
+    conn.executemany(f'DELETE FROM {table} WHERE id = ?', doomed)
+
+def get_message(service, message_id, conn=None):
+    """One full parsed message, from the cache when it's there"""
+    if conn is not None:
+        cached = get_cached(conn, [message_id])
+        if message_id in cached:
+            return cached[message_id]
+    
+    request = service.users().messages().get(
+        userId='me',
+        id=message_id,
+        format='full'
+    )
+    message = parse_message(gmail_scheduler().call(request.execute, 'messages.get'))
+    if conn is not None:
+        put_cached(conn, [message])
+    return message
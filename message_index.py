@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Local full-text index over cached messages
+An inverted index of the subject, sender and body words of everything
+in the message cache, kept in the same SQLite file. Posting lists are
+delta-encoded varints that new messages are appended to, so Gmail-style
+queries run locally in milliseconds and Gmail itself only has to be
+searched for mail that arrived since the last run.
+
+Usage:
+  python3 message_index.py '"auto-renewal" OR "recurring charge"'   # no network
+  python3 message_index.py --rebuild 'subject:invoice after:2025/01/01'
+"""
+
+import argparse
+import re
+import time
+from datetime import datetime, timezone
+from message_cache import CACHE_FILE, open_cache
+from gmail_history import (STATE_FILE, AFTER_MARGIN_SECONDS, load_state, save_state,
+                           current_history_id, messages_added_since)
+from email_dates import message_timestamp
+from instrumentation import span, incr
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+# Posting-list keys are '<field prefix>:<word>'
+FIELD_PREFIXES = {'subject': 's', 'sender': 'f', 'body': 'b'}
+# Gmail search operators -> message fields they look in
+QUERY_FIELDS = {
+    'subject': ('subject',),
+    'from': ('sender',),
+    None: ('subject', 'sender', 'body'),
+}
+
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|(-)?(?:(\w+):)?("[^"]*"|\(|[^\s()"]+))')
+
+def encode_postings(docnos, last=0):
+    """Ascending doc numbers -> varint deltas from last"""
+    out = bytearray()
+    for docno in docnos:
+        delta = docno - last
+        last = docno
+        while delta >= 0x80:
+            out.append(delta & 0x7f | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+def decode_postings(data):
+    docnos = []
+    docno = delta = shift = 0
+    for byte in data:
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            docno += delta
+            docnos.append(docno)
+            delta = shift = 0
+    return docnos
+
+def words(text):
+    return WORD_RE.findall(text.lower())
+
+def _contains_phrase(text, phrase):
+    return f' {phrase} ' in f' {" ".join(words(text))} '
+
+def _cutoff(value):
+    """after:/before: value (epoch seconds or YYYY/MM/DD) -> epoch seconds"""
+    if value.isdigit():
+        return int(value)
+    return datetime.strptime(value, '%Y/%m/%d').replace(tzinfo=timezone.utc).timestamp()
+
+def _tokens(query):
+    pos = 0
+    while pos < len(query):
+        match = _TOKEN_RE.match(query, pos)
+        if not match or match.end() == pos:
+            break
+        pos = match.end()
+        lparen, rparen, negate, field, value = match.groups()
+        if lparen:
+            yield ('(', None, None, False)
+        elif rparen:
+            yield (')', None, None, False)
+        elif value == '(':
+            yield ('group', field and field.lower(), None, bool(negate))
+        elif value == 'OR' and not field:
+            yield ('OR', None, None, False)
+        else:
+            yield ('term', field and field.lower(), value, bool(negate))
+
+class MessageIndex:
+    """
+    Usage:
+        index = MessageIndex(open_cache())
+        index.update()                      # index whatever was cached since last time
+        ids = index.search_all(queries)     # newest first
+    
+    Documents are numbered in the order they're indexed, so appending to
+    a posting list never has to rewrite it. A message that was indexed
+    from headers alone and later cached in full gets a new number; the
+    old one just stops resolving until --rebuild compacts it away.
+    Cache eviction doesn't touch the index: evicted messages still match
+    and are fetched again when a scan needs them.
+    """
+    
+    def __init__(self, conn):
+        self.conn = conn
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS index_docs (
+                docno INTEGER PRIMARY KEY,
+                id TEXT,
+                timestamp INTEGER,
+                full INTEGER
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS index_docs_id ON index_docs (id)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS index_terms (
+                term TEXT PRIMARY KEY,
+                last INTEGER,
+                postings BLOB
+            )
+        ''')
+        self._docs = None
+    
+    @property
+    def docs(self):
+        """{docno: (message id, timestamp)} for every live document"""
+        if self._docs is None:
+            self._docs = {docno: (message_id, timestamp) for docno, message_id, timestamp
+                          in self.conn.execute('SELECT docno, id, timestamp FROM index_docs')}
+        return self._docs
+    
+    def __len__(self):
+        return len(self.docs)
+    
+    def has(self, message_id):
+        row = self.conn.execute('SELECT 1 FROM index_docs WHERE id = ?', (message_id,)).fetchone()
+        return row is not None
+    
+    def update(self):
+        """Index cached messages that aren't indexed yet; returns how many were added"""
+        rows = self.conn.execute('''
+            SELECT id, subject, sender, body, date, timestamp, 1 FROM messages
+            WHERE id NOT IN (SELECT id FROM index_docs WHERE full = 1)
+            UNION ALL
+            SELECT id, subject, sender, body, date, timestamp, 0 FROM headers
+            WHERE id NOT IN (SELECT id FROM index_docs)
+              AND id NOT IN (SELECT id FROM messages)
+        ''').fetchall()
+        if not rows:
+            return 0
+        
+        with span('index'):
+            docno = self.conn.execute('SELECT COALESCE(MAX(docno), 0) FROM index_docs').fetchone()[0]
+            new_docs = []
+            postings = {}
+            for message_id, subject, sender, body, date, timestamp, full in rows:
+                docno += 1
+                timestamp = message_timestamp({'timestamp': timestamp, 'date': date or ''})
+                new_docs.append((docno, message_id, timestamp, full))
+                for field, text in (('subject', subject), ('sender', sender), ('body', body)):
+                    prefix = FIELD_PREFIXES[field]
+                    for word in set(words(text or '')):
+                        postings.setdefault(f'{prefix}:{word}', []).append(docno)
+            
+            # Superseded header-only documents
+            self.conn.executemany('DELETE FROM index_docs WHERE id = ?',
+                                  [(doc[1],) for doc in new_docs if doc[3]])
+            self.conn.executemany('INSERT INTO index_docs VALUES (?, ?, ?, ?)', new_docs)
+            self._append(postings)
+            self.conn.commit()
+        self._docs = None
+        incr('index.added', len(rows))
+        return len(rows)
+    
+    def _append(self, postings):
+        terms = list(postings)
+        stored = {}
+        for start in range(0, len(terms), 500):
+            chunk = terms[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for term, last, data in self.conn.execute(
+                    f'SELECT term, last, postings FROM index_terms WHERE term IN ({placeholders})', chunk):
+                stored[term] = (last, data)
+        rows = []
+        for term, docnos in postings.items():
+            last, data = stored.get(term, (0, b''))
+            rows.append((term, docnos[-1], data + encode_postings(docnos, last)))
+        self.conn.executemany('INSERT OR REPLACE INTO index_terms VALUES (?, ?, ?)', rows)
+    
+    def rebuild(self):
+        """Drop and re-create the index from the cache, compacting superseded documents"""
+        self.conn.execute('DELETE FROM index_docs')
+        self.conn.execute('DELETE FROM index_terms')
+        self._docs = None
+        return self.update()
+    
+    def _postings(self, term):
+        row = self.conn.execute('SELECT postings FROM index_terms WHERE term = ?', (term,)).fetchone()
+        return set(decode_postings(row[0])) if row else set()
+    
+    def _texts(self, docnos, field):
+        """{docno: field text} for docnos still in the cache"""
+        by_id = {self.docs[d][0]: d for d in docnos if d in self.docs}
+        ids = list(by_id)
+        texts = {}
+        for table in ('headers', 'messages'):  # Full messages win
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for message_id, text in self.conn.execute(
+                        f'SELECT id, {field} FROM {table} WHERE id IN ({placeholders})', chunk):
+                    texts[by_id[message_id]] = text or ''
+        return texts
+    
+    def _match(self, field, value):
+        """Documents where value's words appear (adjacent, for phrases) in field"""
+        if field in ('after', 'before'):
+            cutoff = _cutoff(value)
+            if field == 'after':
+                return {d for d, (_, timestamp) in self.docs.items() if timestamp > cutoff}
+            return {d for d, (_, timestamp) in self.docs.items() if timestamp < cutoff}
+        if field not in QUERY_FIELDS:
+            raise ValueError(f"{field}: can't be answered from the local index")
+        
+        phrase = words(value)
+        if not phrase:
+            return set()
+        matched = set()
+        for name in QUERY_FIELDS[field]:
+            prefix = FIELD_PREFIXES[name]
+            found = None
+            for word in dict.fromkeys(phrase):
+                postings = self._postings(f'{prefix}:{word}')
+                found = postings if found is None else found & postings
+                if not found:
+                    break
+            if found and len(phrase) > 1:
+                # Posting lists don't keep positions; check word order on
+                # the cached text (evicted messages are given the benefit
+                # of the doubt)
+                texts = self._texts(found, name)
+                joined = ' '.join(phrase)
+                found = {d for d in found if d not in texts or _contains_phrase(texts[d], joined)}
+            matched |= found or set()
+        return matched
+    
+    def _evaluate(self, query):
+        """
+        Gmail search query -> set of docnos. Like Gmail, OR binds tighter
+        than the implicit AND, and field:(...) applies field to every
+        term inside.
+        """
+        tokens = list(_tokens(query))
+        pos = 0
+        
+        def parse_and(field):
+            result = None
+            while pos < len(tokens) and tokens[pos][0] != ')':
+                term = parse_or(field)
+                result = term if result is None else result & term
+            return set(self.docs) if result is None else result
+        
+        def parse_or(field):
+            nonlocal pos
+            result = parse_unary(field)
+            while pos < len(tokens) and tokens[pos][0] == 'OR':
+                pos += 1
+                result = result | parse_unary(field)
+            return result
+        
+        def parse_unary(field):
+            nonlocal pos
+            if pos >= len(tokens) or tokens[pos][0] == ')':
+                raise ValueError(f"malformed query: missing term after OR in {query!r}")
+            kind, name, value, negate = tokens[pos]
+            pos += 1
+            if kind == 'OR':
+                return set()  # Stray OR
+            if kind in ('(', 'group'):
+                inner = parse_and(name or field)
+                if pos >= len(tokens):
+                    raise ValueError(f"malformed query: unmatched '(' in {query!r}")
+                pos += 1  # ')'
+            else:
+                inner = self._match(name or field, value)
+            return set(self.docs) - inner if negate else inner
+        
+        result = parse_and(None)
+        if pos < len(tokens):
+            raise ValueError(f"malformed query: unmatched ')' in {query!r}")
+        return result
+    
+    def search(self, query):
+        """Message IDs matching one Gmail search query, newest first"""
+        return self.search_all([query])
+    
+    def search_all(self, queries):
+        """Message IDs matching any of queries, newest first"""
+        with span('index'):
+            matched = set()
+            for query in queries:
+                matched |= self._evaluate(query)
+            docs = self.docs
+            hits = [docs[d] for d in matched if d in docs]
+            hits.sort(key=lambda hit: hit[1], reverse=True)
+        incr('index.queries', len(queries))
+        return [message_id for message_id, _ in hits]
+
+def indexed_search(service, name, queries, search, conn, path=STATE_FILE):
+    """
+    Like gmail_history.incremental_search, but the results come from
+    the local index, so changing queries doesn't mean searching Gmail
+    again. search(after=<epoch seconds>) is only called for mail that
+    arrived since the last run (after one history.list call says there
+    is some). The first run does one full search(), since only mail
+    that's been fetched before is indexed.
+    
+    IDs Gmail returned that haven't been fetched (and so indexed) yet
+    are remembered and returned until they are. Returns message stubs,
+    newest first.
+    """
+    index = MessageIndex(conn)
+    index.update()
+    state = load_state(name, path)
+    started = int(time.time())
+    
+    added = None
+    if state.get('historyId'):
+        added, history_id = messages_added_since(service, state['historyId'])
+    
+    if added is None:
+        history_id = current_history_id(service)
+        fresh = [msg['id'] for msg in search()]
+    elif added:
+        after = state.get('lastRun', started) - AFTER_MARGIN_SECONDS
+        fresh = [msg['id'] for msg in search(after=after)]
+    else:
+        fresh = []
+    
+    unindexed = [m for m in dict.fromkeys(fresh + state.get('unindexed', [])) if not index.has(m)]
+    local = index.search_all(queries)
+    print(f"🗂️  {len(local)} matches in the local index ({len(index)} messages), "
+          f"{len(unindexed)} not fetched yet")
+    
+    save_state(name, {
+        'historyId': history_id,
+        'lastRun': started,
+        'unindexed': unindexed
+    }, path)
+    return [{'id': m} for m in dict.fromkeys(unindexed + local)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Search the local message index (no network)')
+    parser.add_argument('query', nargs='*', help='Gmail search syntax: words, "phrases", '
+                        'subject:, from:, after:, before:, OR, -, (...)')
+    parser.add_argument('--cache', default=CACHE_FILE, metavar='FILE',
+                        help=f'message cache to index (default {CACHE_FILE})')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='re-index the whole cache from scratch')
+    parser.add_argument('--limit', type=int, default=50, metavar='N', help='show at most N matches')
+    args = parser.parse_args()
+    
+    conn = open_cache(args.cache)
+    index = MessageIndex(conn)
+    started = time.perf_counter()
+    added = index.rebuild() if args.rebuild else index.update()
+    if added:
+        print(f"🗂️  Indexed {added} messages in {time.perf_counter() - started:.2f}s")
+    if not args.query:
+        print(f"🗂️  {len(index)} messages indexed")
+        return
+    
+    query = ' '.join(args.query)
+    started = time.perf_counter()
+    ids = index.search(query)
+    print(f"🔍 {len(ids)} matches for {query} ({(time.perf_counter() - started) * 1000:.1f} ms)\n")
+    rows = {}
+    for table in ('headers', 'messages'):
+        for message_id in ids[:args.limit]:
+            row = conn.execute(f'SELECT sender, subject FROM {table} WHERE id = ?',
+                               (message_id,)).fetchone()
+            if row:
+                rows[message_id] = row
+    timestamps = dict(index.docs.values())
+    for message_id in ids[:args.limit]:
+        sender, subject = rows.get(message_id, ('(evicted from cache)', ''))
+        when = f'{datetime.fromtimestamp(timestamps[message_id]):%Y-%m-%d}' if timestamps.get(message_id) else ''
+        print(f"  {when:10}  {sender[:35]:35} {subject[:60]}")
+
+if __name__ == '__main__':
+    main()
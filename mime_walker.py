@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Gmail MIME part walker
+Finds the readable body in arbitrarily nested multipart payloads and
+decodes only as much of it as amount detection needs
+"""
+
+import base64
+import html
+import re
+
+# Receipts put the amount near the top; don't decode whole newsletters
+MAX_TEXT_BYTES = 32 * 1024
+# HTML is mostly markup, so allow more raw bytes for the same amount of text
+MAX_HTML_BYTES = 128 * 1024
+
+_SCRIPT_STYLE_RE = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_BLOCK_RE = re.compile(r'<(br|/p|/div|/tr|/li|/h\d)\b[^>]*>', re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]*>')
+_SPACE_RE = re.compile(r'[ \t\r\f\v]+')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+
+def iter_leaf_parts(payload):
+    """Yield the non-multipart parts of a payload in document order, without recursion"""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get('parts')
+        if children:
+            # Reversed so the first child is popped first
+            stack.extend(reversed(children))
+        else:
+            yield part
+
+def find_body_part(payload):
+    """
+    Return (part, mime_type) for the best readable body: the first
+    inline text/plain part, else the first text/html part, else None
+    """
+    html_part = None
+    for part in iter_leaf_parts(payload):
+        if part.get('filename') or 'data' not in part.get('body', {}):
+            continue  # attachment, or body stored separately
+        mime_type = part.get('mimeType', '').lower()
+        if mime_type == 'text/plain':
+            return part, mime_type
+        if mime_type == 'text/html' and html_part is None:
+            html_part = part
+    if html_part is not None:
+        return html_part, 'text/html'
+    return None, None
+
+def decode_prefix(data, max_bytes):
+    """
+    Decode at most max_bytes from Gmail's base64url body data. Only the
+    base64 characters needed are sliced out (a memoryview for bytes
+    input), so a multi-megabyte body costs no more than its first block.
+    """
+    needed = -(-max_bytes // 3) * 4
+    if isinstance(data, str):
+        chunk = data[:needed].encode('ascii', errors='ignore')
+    else:
+        chunk = memoryview(data)[:needed].tobytes()
+    chunk = chunk.rstrip(b'=')
+    if len(chunk) % 4 == 1:
+        chunk = chunk[:-1]  # A lone trailing character carries no full byte
+    chunk += b'=' * (-len(chunk) % 4)
+    decoded = base64.urlsafe_b64decode(chunk)
+    return str(memoryview(decoded)[:max_bytes], 'utf-8', 'ignore')
+
+def html_to_text(markup):
+    """Crude but fast HTML -> text, good enough for finding amounts"""
+    text = _SCRIPT_STYLE_RE.sub(' ', markup)
+    text = _BLOCK_RE.sub('\n', text)
+    text = _TAG_RE.sub(' ', text)
+    text = html.unescape(text)
+    text = _SPACE_RE.sub(' ', text)
+    return _BLANK_LINES_RE.sub('\n', text).strip()
+
+def extract_body(payload, max_text_bytes=MAX_TEXT_BYTES, max_html_bytes=MAX_HTML_BYTES):
+    """Readable body text for a Gmail payload, truncated to the first few KB"""
+    part, mime_type = find_body_part(payload)
+    if part is None:
+        return ''
+    if mime_type == 'text/html':
+        return html_to_text(decode_prefix(part['body']['data'], max_html_bytes))
+    return decode_prefix(part['body']['data'], max_text_bytes)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Gmail quota-aware request scheduler
+A token bucket in Gmail quota units, jittered exponential backoff that
+honors Retry-After, and AIMD concurrency and batch sizing that back off
+when Gmail throttles and creep back up while it doesn't
+"""
+
+import asyncio
+import random
+import sys
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import httplib2
+from googleapiclient.errors import HttpError
+from instrumentation import span, incr
+
+# Gmail's per-user limit is 15,000 quota units a minute, enforced as a
+# moving average that tolerates short bursts
+UNITS_PER_SECOND = 250
+BURST_SECONDS = 4
+
+# Quota cost of each method we call (Gmail API usage limits table)
+QUOTA_UNITS = {
+    'messages.get': 5,
+    'messages.list': 5,
+    'messages.send': 100,
+    'history.list': 2,
+    'users.getProfile': 1,
+}
+DEFAULT_UNITS = 5
+
+MAX_CONCURRENCY = 4
+MAX_BATCH = 50
+MIN_BATCH = 5
+BATCH_STEP = 5
+
+MAX_ATTEMPTS = 6
+BASE_DELAY = 1.0
+MAX_DELAY = 32.0
+
+def is_retryable(error):
+    """Throttling and server errors are worth retrying; 404s and bad requests aren't"""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is None or status == 429 or status >= 500:
+        return True
+    # Gmail also reports per-user rate limits as 403 rateLimitExceeded
+    return status == 403 and b'ateLimitExceeded' in (getattr(error, 'content', None) or b'')
+
+def is_network_error(error):
+    """
+    Timeouts, dropped connections and DNS failures, from httplib2 or
+    (with --async) aiohttp: the request may never have arrived, so
+    they're retried like server errors
+    """
+    if isinstance(error, (OSError, asyncio.TimeoutError, httplib2.HttpLib2Error)):
+        return True
+    # Only look for aiohttp's errors if it's in use; it's optional
+    aiohttp = sys.modules.get('aiohttp')
+    return aiohttp is not None and isinstance(error, aiohttp.ClientError)
+
+def is_throttle(error):
+    """Rejected for quota, so it certainly wasn't carried out"""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    return status in (429, 403) and is_retryable(error)
+
+def retry_after(error):
+    """Seconds the server asked us to wait, or None"""
+    resp = getattr(error, 'resp', None)
+    value = resp.get('retry-after') if hasattr(resp, 'get') else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+class TokenBucket:
+    """Quota units refilled at rate per second, up to capacity"""
+    
+    def __init__(self, rate=UNITS_PER_SECOND, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity or rate * BURST_SECONDS
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+    
+    def pause(self, seconds):
+        """Hold every caller back for seconds (a server-sent Retry-After)"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+    
+    def acquire(self, units):
+        """
+        Block until units can be spent. Requests bigger than the bucket
+        wait for a full bucket and leave it in debt.
+        """
+        needed = min(units, self.capacity)
+        while True:
+            with self._lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= needed:
+                    self.tokens -= units
+                    return
+                wait = max(self.paused_until - now, (needed - self.tokens) / self.rate)
+            self.sleep(wait)
+
+class Scheduler:
+    """
+    Shared by every Gmail call in the process: callers take a
+    concurrency slot, spend quota units, and report throttling back so
+    concurrency and batch size follow what Gmail will accept
+    """
+    
+    def __init__(self, units_per_second=UNITS_PER_SECOND, max_concurrency=MAX_CONCURRENCY,
+                 max_batch=MAX_BATCH, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY,
+                 max_delay=MAX_DELAY, clock=time.monotonic, sleep=time.sleep):
+        self.bucket = TokenBucket(units_per_second, clock=clock, sleep=sleep)
+        self.max_concurrency = max_concurrency
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.concurrency = max_concurrency
+        self.batch_size = max_batch
+        self._in_flight = 0
+        self._successes = 0
+        self._slots = threading.Condition()
+    
+    def acquire(self, method, count=1):
+        self.bucket.acquire(QUOTA_UNITS.get(method, DEFAULT_UNITS) * count)
+    
+    def slot(self):
+        """Context manager for one in-flight request under the current concurrency limit"""
+        return _Slot(self)
+    
+    def succeeded(self):
+        """Additive increase: one more slot and a bigger batch per window of successes"""
+        with self._slots:
+            self._successes += 1
+            if self._successes >= self.concurrency:
+                self._successes = 0
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                self.batch_size = min(self.max_batch, self.batch_size + BATCH_STEP)
+                self._slots.notify_all()
+    
+    def throttled(self, wait=None):
+        """Multiplicative decrease, plus a shared pause if the server asked for one"""
+        incr('throttled')
+        with self._slots:
+            self._successes = 0
+            self.concurrency = max(1, self.concurrency // 2)
+            self.batch_size = max(MIN_BATCH, self.batch_size // 2)
+        if wait:
+            self.bucket.pause(wait)
+    
+    def backoff(self, attempt, wait=None):
+        """Sleep before retry number attempt (0-based): full jitter, at least Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        delay = max(delay, wait or 0)
+        with span('backoff'):
+            self.sleep(delay)
+    
+    def call(self, fn, method, count=1, idempotent=True):
+        """
+        Run fn() (one API request) within quota, retrying throttled,
+        server and network errors with backoff. Raises the last error once
+        attempts run out, or immediately for errors that won't go away.
+        For requests that mustn't run twice (sends), only throttling is
+        retried since after anything else the request may have gone through.
+        """
+        for attempt in range(self.max_attempts):
+            self.acquire(method, count)
+            try:
+                with self.slot():
+                    result = fn()
+            except Exception as e:
+                if isinstance(e, HttpError):
+                    retry = is_retryable(e) and (idempotent or is_throttle(e))
+                else:
+                    retry = is_network_error(e) and idempotent
+                if not retry or attempt == self.max_attempts - 1:
+                    raise
+                wait = retry_after(e)
+                self.throttled(wait)
+                incr(f'retries.{method}')
+                self.backoff(attempt, wait)
+                continue
+            self.succeeded()
+            return result
+
+class _Slot:
+    __slots__ = ('scheduler',)
+    
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+    
+    def __enter__(self):
+        scheduler = self.scheduler
+        with scheduler._slots:
+            while scheduler._in_flight >= scheduler.concurrency:
+                scheduler._slots.wait()
+            scheduler._in_flight += 1
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        scheduler = self.scheduler
+        with scheduler._slots:
+            scheduler._in_flight -= 1
+            scheduler._slots.notify()
+        return False
+
+_default = None
+_default_lock = threading.Lock()
+
+def gmail_scheduler():
+    """The process-wide scheduler every Gmail call shares"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Scheduler()
+        return _default
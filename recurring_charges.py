@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Recurring-charge detection
+Infers each vendor's billing period from the gaps between its receipt
+dates instead of from wording, and flags price changes and charges that
+have stopped arriving
+"""
+
+import time
+from array import array
+from collections import Counter, namedtuple
+
+DAY = 86400
+
+# (name, typical gap in days, tolerance in days)
+PERIODS = (
+    ('weekly', 7, 2),
+    ('monthly', 30, 4),
+    ('quarterly', 91, 8),
+    ('yearly', 365, 20),
+)
+
+# Receipts this close together are one charge (order confirmation + receipt)
+SAME_CHARGE_DAYS = 3
+MIN_CHARGES = {'weekly': 3, 'monthly': 3, 'quarterly': 2, 'yearly': 2}
+# Share of gaps that must sit within tolerance of the period
+REGULARITY = 0.6
+# Overdue by this many periods counts as cancelled
+CANCEL_AFTER_PERIODS = 1.5
+PRICE_TOLERANCE = 0.01
+
+RecurringCharge = namedtuple('RecurringCharge', [
+    'company', 'period', 'period_days', 'charges', 'amount', 'first_seen', 'last_seen',
+    'next_due', 'price_changes', 'status'
+])
+
+def vendor_series(ledger):
+    """{company code: (timestamps, amounts)} as typed arrays, one pass over the ledger"""
+    series = {}
+    for company, amount, timestamp in zip(ledger.company, ledger.amount, ledger.timestamp):
+        if not timestamp:
+            continue
+        columns = series.get(company)
+        if columns is None:
+            columns = series[company] = (array('q'), array('d'))
+        columns[0].append(timestamp)
+        columns[1].append(amount)
+    return series
+
+def charge_series(timestamps, amounts):
+    """
+    Sorted, de-duplicated charges as (timestamps, amounts) arrays.
+    Receipts usually arrive in date order (or reverse), which Python's
+    sort handles in linear time.
+    """
+    order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+    times, values = array('q'), array('d')
+    for i in order:
+        if times and timestamps[i] - times[-1] < SAME_CHARGE_DAYS * DAY:
+            values[-1] = max(values[-1], amounts[i])
+        else:
+            times.append(timestamps[i])
+            values.append(amounts[i])
+    return times, values
+
+def median_gap_days(times):
+    """
+    Median whole-day gap between consecutive charges. Gaps are bucketed
+    by day, so this is linear however many charges there are.
+    """
+    gaps = Counter((b - a) // DAY for a, b in zip(times, times[1:]))
+    middle = (sum(gaps.values()) - 1) // 2
+    for days in sorted(gaps):
+        middle -= gaps[days]
+        if middle < 0:
+            return days
+    return None
+
+def match_period(times):
+    """(name, days) of the billing period times fit, or None"""
+    gap = median_gap_days(times)
+    if gap is None:
+        return None
+    for name, days, tolerance in PERIODS:
+        if abs(gap - days) > tolerance or len(times) < MIN_CHARGES[name]:
+            continue
+        gaps = [(b - a) / DAY for a, b in zip(times, times[1:])]
+        # A missed month or two still counts: compare each gap to its nearest multiple
+        regular = sum(1 for g in gaps
+                      if abs(g - days * max(1, round(g / days))) <= tolerance)
+        if regular >= REGULARITY * len(gaps):
+            return name, days
+    return None
+
+def price_changes(times, values):
+    """[(timestamp, old amount, new amount), ...] between consecutive charges"""
+    changes = []
+    for i in range(1, len(values)):
+        old, new = values[i - 1], values[i]
+        if abs(new - old) > PRICE_TOLERANCE * max(old, new):
+            changes.append((times[i], old, new))
+    return changes
+
+def detect_recurring(ledger, now=None):
+    """RecurringCharge for every vendor whose receipts follow a billing period"""
+    now = now or int(time.time())
+    found = []
+    for company, (timestamps, amounts) in vendor_series(ledger).items():
+        times, values = charge_series(timestamps, amounts)
+        period = match_period(times)
+        if period is None:
+            continue
+        name, days = period
+        next_due = times[-1] + days * DAY
+        overdue = now - times[-1] > CANCEL_AFTER_PERIODS * days * DAY
+        found.append(RecurringCharge(
+            company=ledger.companies[company],
+            period=name,
+            period_days=days,
+            charges=len(times),
+            amount=values[-1],
+            first_seen=times[0],
+            last_seen=times[-1],
+            next_due=next_due,
+            price_changes=price_changes(times, values),
+            status='cancelled' if overdue else 'active'
+        ))
+    found.sort(key=lambda charge: charge.last_seen, reverse=True)
+    return found
+
+def fill_frequencies(monthly, yearly, unknown, recurring):
+    """
+    Move unknown-frequency companies whose receipts show a monthly or
+    yearly period into that bucket (unless they're already there, in
+    which case the unknown entry is the same subscription and is
+    dropped). Charges that look cancelled are taken out of every bucket
+    so they don't count toward the totals; the recurring section still
+    lists them. Returns new (monthly, yearly, unknown).
+    """
+    monthly, yearly, unknown = dict(monthly), dict(yearly), dict(unknown)
+    buckets = {'monthly': monthly, 'yearly': yearly}
+    for charge in recurring:
+        if charge.status == 'cancelled':
+            for bucket in (monthly, yearly, unknown):
+                bucket.pop(charge.company, None)
+            continue
+        bucket = buckets.get(charge.period)
+        if bucket is not None and charge.company in unknown:
+            amount = unknown.pop(charge.company)
+            bucket.setdefault(charge.company, amount)
+    return monthly, yearly, unknown
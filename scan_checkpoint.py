@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Resumable full-mailbox scans
+Processes search results in segments and checkpoints the processed IDs
+plus the caller's partial aggregates after each one, so an interrupted
+scan picks up where it left off
+"""
+
+import json
+import os
+import sys
+import time
+from gmail_batch import chunked
+from atomic_file import write_json
+
+CHECKPOINT_EVERY = 500
+VERSION = 1
+
+class ScanCheckpoint:
+    """
+    Usage:
+        checkpoint = ScanCheckpoint(path)
+        state = checkpoint.load()          # None for a fresh scan
+        for segment in checkpoint.segments(messages):
+            ...process segment, update aggregates...
+            checkpoint.commit(segment, aggregates_as_json)
+        checkpoint.finish()
+    
+    Only whole segments are committed, so work cut off mid-segment is
+    simply redone on resume (cheaply, with the message cache).
+    """
+    
+    def __init__(self, path, every=CHECKPOINT_EVERY):
+        self.path = path
+        self.every = every
+        self.processed = set()
+        self.started = int(time.time())
+    
+    def load(self):
+        """Restore progress; returns the saved aggregates, or None if there's nothing to resume"""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != VERSION:
+            return None
+        self.processed = set(data['processed'])
+        self.started = data.get('started', self.started)
+        return data['state']
+    
+    def segments(self, messages):
+        """Lists of up to every unprocessed IDs from a stream of message stubs"""
+        pending = (msg['id'] for msg in messages if msg['id'] not in self.processed)
+        return chunked(pending, self.every)
+    
+    def commit(self, segment, state):
+        """Mark segment done and save it together with the aggregates it produced"""
+        self.processed.update(segment)
+        data = {
+            'version': VERSION,
+            'started': self.started,
+            'updated': int(time.time()),
+            'processed': list(self.processed),
+            'state': state
+        }
+        write_json(self.path, data)
+    
+    def finish(self):
+        """The scan completed; the next one starts from scratch"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def discard(self):
+        self.processed = set()
+        self.finish()
+
+def run_segments(args, messages, process, save, restore):
+    """
+    The --full loop: resume from args.checkpoint (unless args.restart),
+    process() each unprocessed segment of message IDs, and checkpoint
+    save()'s aggregates after each one. restore() gets saved aggregates
+    back on resume. Ctrl-C exits with progress kept. Returns the set of
+    message IDs processed.
+    """
+    checkpoint = ScanCheckpoint(args.checkpoint, args.checkpoint_every)
+    if args.restart:
+        checkpoint.discard()
+    state = checkpoint.load()
+    if state:
+        restore(state)
+        print(f"↩️  Resuming scan: {len(checkpoint.processed)} messages already done\n")
+    
+    try:
+        for segment in checkpoint.segments(messages):
+            process(segment)
+            checkpoint.commit(segment, save())
+            print(f"   💾 {len(checkpoint.processed)} messages scanned")
+    except KeyboardInterrupt:
+        print(f"\n⏸️  Interrupted. Progress is saved in {args.checkpoint}; "
+              "run with --full again to resume.")
+        sys.exit(130)
+    checkpoint.finish()
+    return checkpoint.processed
@@ -1,59 +1,82 @@
 #!/usr/bin/env python3
-"""Quick Gmail sender"""
-import os.path
-import pickle
-import base64
-from email.mime.text import MIMEText
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+"""
+Quick Gmail sender
+
+Usage:
+  send_email.py <to> <subject> <body>            # send one email now
+  send_email.py --queue <to> <subject> <body>    # add it to the outbox (no auth, instant)
+  send_email.py --drain                          # send everything queued, in batches
+  send_email.py --status                         # outbox counts and recent failures
+"""
+import argparse
+import json
+import sys
+from google_client import get_service
+from gmail_outbox import OUTBOX_DIR, encode_message, enqueue, drain, status
+from instrumentation import span, incr, error, add_arguments, report_at_exit
+from rate_limit import gmail_scheduler
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
-def authenticate():
-    creds = None
-    token_file = 'gmail_token.pickle'
-    
-    if os.path.exists(token_file):
-        with open(token_file, 'rb') as token:
-            creds = pickle.load(token)
-    
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'gmail_credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        
-        with open(token_file, 'wb') as token:
-            pickle.dump(creds, token)
-    
-    return build('gmail', 'v1', credentials=creds)
+def authenticate(use_async=False):
+    return get_service('gmail', 'v1', token_file='gmail_token.pickle', scopes=SCOPES,
+                       credentials_file='gmail_credentials.json', use_async=use_async)
 
 def send_email(service, to, subject, body):
-    message = MIMEText(body)
-    message['to'] = to
-    message['subject'] = subject
-    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
+    raw = encode_message(to, subject, body)
     
     try:
-        message = service.users().messages().send(
+        incr('api.messages.send')
+        request = service.users().messages().send(
             userId='me',
             body={'raw': raw}
-        ).execute()
+        )
+        with span('send'):
+            message = gmail_scheduler().call(request.execute, 'messages.send', idempotent=False)
         return True
     except Exception as e:
+        error('send', e)
         print(f"Error: {e}")
         return False
 
-if __name__ == '__main__':
-    import sys
-    if len(sys.argv) < 4:
-        print("Usage: send_email.py <to> <subject> <body>")
+def main():
+    parser = argparse.ArgumentParser(description='Send email through Gmail, now or via the outbox')
+    parser.add_argument('message', nargs='*', metavar='TO SUBJECT BODY')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--queue', action='store_true',
+                      help='add the message to the outbox instead of sending it')
+    mode.add_argument('--drain', action='store_true',
+                      help='send every queued message with one client, in batches')
+    mode.add_argument('--status', action='store_true', help='show outbox counts and recent failures')
+    parser.add_argument('--outbox', default=OUTBOX_DIR, metavar='DIR',
+                        help=f'outbox directory (default {OUTBOX_DIR})')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='use the aiohttp client (google_async) instead of googleapiclient')
+    add_arguments(parser)
+    args = parser.parse_args()
+    report_at_exit('send_email', args.profile, args.trace)
+    
+    if args.status:
+        print(json.dumps(status(args.outbox), indent=2))
+        return
+    if args.drain:
+        counts = drain(authenticate(args.use_async), args.outbox)
+        if counts.get('busy'):
+            print("⏳ Another drain is already sending this outbox")
+            sys.exit(0)
+        print(f"📤 Sent {counts.get('sent', 0)}, failed {counts.get('failed', 0)}, "
+              f"requeued {counts.get('requeued', 0)}")
+        sys.exit(1 if counts.get('failed') else 0)
+    if len(args.message) != 3:
+        parser.print_usage()
         sys.exit(1)
     
-    service = authenticate()
-    success = send_email(service, sys.argv[1], sys.argv[2], sys.argv[3])
+    to, subject, body = args.message
+    if args.queue:
+        print(f"📥 Queued {enqueue(to, subject, body, args.outbox)}")
+        return
+    success = send_email(authenticate(args.use_async), to, subject, body)
     print("✅ Sent!" if success else "❌ Failed")
+
+if __name__ == '__main__':
+    main()
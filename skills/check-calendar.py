@@ -5,65 +5,52 @@ Check Google Calendar for upcoming events
 
 import os
 import sys
-import pickle
-from datetime import datetime, timedelta
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+import time
+import argparse
 import json
 
-TOKEN_FILE = '/Users/cpuai/.openclaw/workspace/google_token.pickle'
+WORKSPACE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN_FILE = os.path.join(WORKSPACE, 'google_token.pickle')
+INDEX_FILE = os.path.join(WORKSPACE, 'memory', 'calendar-index.json')
 
-def check_upcoming_events(hours_ahead=48):
-    """Check for events in the next N hours"""
+sys.path.insert(0, WORKSPACE)
+from google_client import get_service
+from calendar_index import load_index, save_index, sync, events_between
+from instrumentation import error, add_arguments, report_at_exit
+
+def check_upcoming_events(hours_ahead=48, use_async=False):
+    """
+    Check for events in the next N hours; returns the JSON-ready result.
+    use_async talks to Calendar through google_async.
+    """
     
     if not os.path.exists(TOKEN_FILE):
-        print(json.dumps({
+        return {
             "error": "Not authenticated. Run: python3 skills/gmail-auth.py"
-        }))
-        return
+        }
     
     try:
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
-        
-        service = build('calendar', 'v3', credentials=creds)
-        
-        # Get events from now to hours_ahead
-        now = datetime.utcnow()
-        time_max = now + timedelta(hours=hours_ahead)
+        service = get_service('calendar', 'v3', token_file=TOKEN_FILE, interactive=False,
+                              use_async=use_async)
         
-        events_result = service.events().list(
-            calendarId='primary',
-            timeMin=now.isoformat() + 'Z',
-            timeMax=time_max.isoformat() + 'Z',
-            maxResults=20,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
+        # Pull only what changed since the last check, then answer locally
+        index = sync(service, load_index(INDEX_FILE))
+        save_index(index, INDEX_FILE)
         
-        events = events_result.get('items', [])
+        now = time.time()
         
         upcoming = []
         urgent = []  # Events <2 hours away
         
-        for event in events:
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            
-            # Parse start time
-            if 'T' in start:
-                start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
-            else:
-                # All-day event
-                continue
-            
-            hours_until = (start_dt - now.replace(tzinfo=None)).total_seconds() / 3600
+        for event in events_between(index, now, now + hours_ahead * 3600):
+            hours_until = (event['start_ts'] - now) / 3600
             
             event_info = {
-                'summary': event.get('summary', 'No title'),
-                'start': start,
+                'summary': event['summary'],
+                'start': event['start'],
                 'hours_until': round(hours_until, 1),
-                'location': event.get('location', ''),
-                'description': event.get('description', '')[:100]
+                'location': event['location'],
+                'description': event['description']
             }
             
             upcoming.append(event_info)
@@ -71,16 +58,24 @@ def check_upcoming_events(hours_ahead=48):
             if hours_until < 2:
                 urgent.append(event_info)
         
-        print(json.dumps({
+        return {
             'total_count': len(upcoming),
             'urgent_count': len(urgent),
             'urgent_events': urgent,
             'upcoming_events': upcoming[:10]
-        }, indent=2))
+        }
         
     except Exception as e:
-        print(json.dumps({'error': str(e)}))
+        error('check-calendar', e)
+        return {'error': str(e)}
 
 if __name__ == '__main__':
-    hours = int(sys.argv[1]) if len(sys.argv) > 1 else 48
-    check_upcoming_events(hours)
+    parser = argparse.ArgumentParser(description='Check Google Calendar for upcoming events')
+    parser.add_argument('hours', nargs='?', type=int, default=48,
+                        help='how many hours ahead to look (default 48)')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='use the aiohttp client (google_async) instead of googleapiclient')
+    add_arguments(parser)
+    args = parser.parse_args()
+    report_at_exit('check-calendar', args.profile, args.trace)
+    print(json.dumps(check_upcoming_events(args.hours, args.use_async), indent=2))
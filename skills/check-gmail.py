@@ -5,88 +5,191 @@ Check Gmail for urgent/important messages
 
 import os
 import sys
-import pickle
+import time
+import argparse
 from datetime import datetime, timedelta
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import json
 
-TOKEN_FILE = '/Users/cpuai/.openclaw/workspace/google_token.pickle'
+WORKSPACE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN_FILE = os.path.join(WORKSPACE, 'google_token.pickle')
+HISTORY_FILE = os.path.join(WORKSPACE, 'memory', 'gmail-history.json')
+SEEN_FILE = os.path.join(WORKSPACE, 'memory', 'gmail-seen.json')
+SEEN_TTL_DAYS = 7
 
-def check_urgent_emails(hours_back=24):
-    """Check for urgent emails in the last N hours"""
+sys.path.insert(0, WORKSPACE)
+from google_client import get_service
+from gmail_batch import fetch_messages
+from gmail_history import load_state, save_state, current_history_id, messages_added_since
+from instrumentation import span, incr, error, add_arguments, report_at_exit
+from rate_limit import gmail_scheduler
+from atomic_file import write_json
+
+URGENT_WORDS = ('urgent', 'asap', 'important')
+METADATA_HEADERS = ['From', 'Subject', 'Date']
+
+def summarize_email(message):
+    """Pick out the fields we report for an urgent email"""
+    headers = {h['name']: h['value'] for h in message['payload']['headers']}
+    return {
+        'id': message['id'],
+        'from': headers.get('From', 'Unknown'),
+        'subject': headers.get('Subject', 'No subject'),
+        'date': headers.get('Date', 'Unknown'),
+        'snippet': message.get('snippet', '')
+    }
+
+def is_urgent(message, after_timestamp):
+    """Local version of the urgent queries for a metadata-format message"""
+    labels = message.get('labelIds', [])
+    if 'UNREAD' not in labels:
+        return False
+    if int(message.get('internalDate', 0)) < after_timestamp * 1000:
+        return False
+    if 'STARRED' in labels or 'IMPORTANT' in labels:
+        return True
+    subject = next((h['value'] for h in message['payload']['headers']
+                    if h['name'].lower() == 'subject'), '').lower()
+    return any(word in subject for word in URGENT_WORDS)
+
+def load_seen():
+    """Load the seen-message index, dropping entries past their TTL"""
+    if not os.path.exists(SEEN_FILE):
+        return {}
+    try:
+        with open(SEEN_FILE) as f:
+            seen = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    cutoff = time.time() - SEEN_TTL_DAYS * 86400
+    return {msg_id: entry for msg_id, entry in seen.items() if entry['seen'] >= cutoff}
+
+def save_seen(seen):
+    write_json(SEEN_FILE, seen)
+
+def fetch_metadata(service, message_ids, seen):
+    """
+    Batch-fetch metadata for the IDs not in the seen index. Yields raw
+    metadata messages; the caller records them in seen.
+    """
+    missing = [m for m in message_ids if m not in seen]
+    return fetch_messages(service, missing, fmt='metadata',
+                          metadata_headers=METADATA_HEADERS, parse=False)
+
+def search_urgent_emails(service, after_timestamp, seen):
+    """Run the urgent queries against the whole mailbox"""
+    urgent_queries = [
+        f'is:unread (subject:urgent OR subject:asap OR subject:important OR is:starred) after:{after_timestamp}',
+        f'is:unread label:important after:{after_timestamp}'
+    ]
+    
+    # Dedupe across both queries before fetching anything
+    message_ids = []
+    for query in urgent_queries:
+        incr('api.messages.list')
+        try:
+            request = service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=10
+            )
+            with span('list'):
+                results = gmail_scheduler().call(request.execute, 'messages.list')
+            message_ids.extend(msg['id'] for msg in results.get('messages', []))
+        except HttpError as e:
+            error('list', e)
+    message_ids = list(dict.fromkeys(message_ids))
+    
+    # A message seen earlier as not urgent may match now (e.g. starred since)
+    for msg_id in message_ids:
+        if msg_id in seen and seen[msg_id]['email'] is None:
+            del seen[msg_id]
+    
+    now = time.time()
+    for message in fetch_metadata(service, message_ids, seen):
+        seen[message['id']] = {'seen': now, 'email': summarize_email(message)}
+    
+    return [seen[m]['email'] for m in message_ids if m in seen]
+
+def new_urgent_emails(service, added, after_timestamp, seen):
+    """Check just the messages that arrived since the last run"""
+    unread_ids = [m['id'] for m in added if 'UNREAD' in m.get('labelIds', [])]
+    now = time.time()
+    for message in fetch_metadata(service, unread_ids, seen):
+        # Remember non-urgent ones too so they're never fetched again
+        urgent = is_urgent(message, after_timestamp)
+        seen[message['id']] = {'seen': now, 'email': summarize_email(message) if urgent else None}
+    return [seen[m]['email'] for m in unread_ids if m in seen and seen[m]['email']]
+
+def check_urgent_emails(hours_back=24, incremental=False, use_async=False):
+    """
+    Check for urgent emails in the last N hours; returns the JSON-ready
+    result. use_async talks to Gmail through google_async.
+    """
     
     if not os.path.exists(TOKEN_FILE):
-        print(json.dumps({
+        return {
             "error": "Not authenticated. Run: python3 skills/gmail-auth.py"
-        }))
-        return
+        }
     
     try:
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
-        
-        service = build('gmail', 'v1', credentials=creds)
+        service = get_service('gmail', 'v1', token_file=TOKEN_FILE, interactive=False,
+                              use_async=use_async)
         
         # Calculate time threshold
         after_time = datetime.now() - timedelta(hours=hours_back)
         after_timestamp = int(after_time.timestamp())
         
-        # Search for urgent emails
-        urgent_queries = [
-            f'is:unread (subject:urgent OR subject:asap OR subject:important OR is:starred) after:{after_timestamp}',
-            f'is:unread label:important after:{after_timestamp}'
-        ]
+        # Urgent mail we've already fetched is answered from the seen index
+        seen = load_seen()
+        previously_seen = set(seen)
+        
+        urgent_emails = None
+        if incremental:
+            # Only look at mail added since the previous incremental run;
+            # fall back to the full queries when that history has expired
+            state = load_state('check-gmail', HISTORY_FILE)
+            if state.get('historyId'):
+                added, history_id = messages_added_since(service, state['historyId'])
+                if added is not None:
+                    urgent_emails = new_urgent_emails(service, added, after_timestamp, seen)
+            if urgent_emails is None:
+                history_id = current_history_id(service)
         
-        urgent_emails = []
+        if urgent_emails is None:
+            urgent_emails = search_urgent_emails(service, after_timestamp, seen)
         
-        for query in urgent_queries:
-            try:
-                results = service.users().messages().list(
-                    userId='me',
-                    q=query,
-                    maxResults=10
-                ).execute()
-                
-                messages = results.get('messages', [])
-                
-                for msg in messages:
-                    # Get full message details
-                    message = service.users().messages().get(
-                        userId='me',
-                        id=msg['id'],
-                        format='metadata',
-                        metadataHeaders=['From', 'Subject', 'Date']
-                    ).execute()
-                    
-                    headers = {h['name']: h['value'] for h in message['payload']['headers']}
-                    
-                    urgent_emails.append({
-                        'id': msg['id'],
-                        'from': headers.get('From', 'Unknown'),
-                        'subject': headers.get('Subject', 'No subject'),
-                        'date': headers.get('Date', 'Unknown'),
-                        'snippet': message.get('snippet', '')
-                    })
-            except HttpError:
-                pass
+        if incremental:
+            save_state('check-gmail', {'historyId': history_id}, HISTORY_FILE)
+        save_seen(seen)
         
         # Remove duplicates
-        seen = set()
+        unique_ids = set()
         unique_emails = []
         for email in urgent_emails:
-            if email['id'] not in seen:
-                seen.add(email['id'])
-                unique_emails.append(email)
+            if email['id'] not in unique_ids:
+                unique_ids.add(email['id'])
+                unique_emails.append(dict(email, new=email['id'] not in previously_seen))
         
-        print(json.dumps({
+        return {
             'count': len(unique_emails),
+            'new_count': sum(1 for email in unique_emails if email['new']),
             'emails': unique_emails[:5]  # Top 5
-        }, indent=2))
-        
+        }
+    
     except Exception as e:
-        print(json.dumps({'error': str(e)}))
+        error('check-gmail', e)
+        return {'error': str(e)}
 
 if __name__ == '__main__':
-    hours = int(sys.argv[1]) if len(sys.argv) > 1 else 24
-    check_urgent_emails(hours)
+    parser = argparse.ArgumentParser(description='Check Gmail for urgent/important messages')
+    parser.add_argument('hours', nargs='?', type=int, default=24,
+                        help='how many hours back to look (default 24)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only report urgent mail that arrived since the last --incremental run')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='use the aiohttp client (google_async) instead of googleapiclient')
+    add_arguments(parser)
+    args = parser.parse_args()
+    report_at_exit('check-gmail', args.profile, args.trace)
+    print(json.dumps(check_urgent_emails(args.hours, args.incremental, args.use_async), indent=2))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Heartbeat daemon
+Keeps one Gmail and one Calendar client alive and runs the email and
+calendar checks on a schedule instead of spawning a process per tick.
+Answers on-demand checks over a local Unix socket.
+
+Usage:
+  python3 skills/heartbeat-daemon.py                  # run the daemon
+  python3 skills/heartbeat-daemon.py --ask status     # last results, instantly
+  python3 skills/heartbeat-daemon.py --ask email [hours]
+  python3 skills/heartbeat-daemon.py --ask calendar [hours]
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WORKSPACE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SKILLS_DIR = os.path.join(WORKSPACE, 'skills')
+STATE_FILE = os.path.join(WORKSPACE, 'memory', 'heartbeat-state.json')
+SOCKET_FILE = os.path.join(WORKSPACE, 'memory', 'heartbeat.sock')
+TRACE_FILE = os.path.join(WORKSPACE, 'memory', 'heartbeat-trace.jsonl')
+# Rotated to heartbeat-trace.jsonl.1 past this, so at most twice this on disk
+TRACE_MAX_BYTES = 1024 * 1024
+
+sys.path.insert(0, WORKSPACE)
+import instrumentation
+from atomic_file import write_json
+
+INTERVAL_MINUTES = 30
+EMAIL_HOURS = 24
+CALENDAR_HOURS = 48
+
+def load_skill(name):
+    """Import a hyphenated skills/<name>.py script as a module"""
+    path = os.path.join(SKILLS_DIR, f'{name}.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def update_state(key, result):
+    """Record a check in heartbeat-state.json the same way the heartbeat does"""
+    state = {}
+    if os.path.exists(STATE_FILE):
+        try:
+            with open(STATE_FILE) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+    state.setdefault('lastChecks', {})[key] = int(time.time() * 1000)
+    state.setdefault('results', {})[key] = result
+    write_json(STATE_FILE, state, indent=2)
+
+def ask(command):
+    """Send one command to a running daemon and print its JSON reply"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(SOCKET_FILE)
+        except OSError:
+            print(json.dumps({'error': 'Heartbeat daemon is not running'}))
+            return 1
+        sock.sendall((' '.join(command) + '\n').encode())
+        reply = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            reply += chunk
+    print(reply.decode().strip())
+    return 0
+
+async def serve(use_async=False):
+    gmail = load_skill('check-gmail')
+    calendar = load_skill('check-calendar')
+    
+    # All API work goes through one thread: the warm clients share one
+    # httplib2 connection, which isn't safe to use concurrently
+    api_thread = ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_running_loop()
+    latest = {}
+    
+    async def run_check(key, fn, *args):
+        result = await loop.run_in_executor(api_thread, fn, *args)
+        latest[key] = result
+        update_state(key, result)
+        # One trace line per check: its spans, API calls and errors
+        instrumentation.append_trace(TRACE_FILE, key, {'ok': 'error' not in result}, clear=True,
+                                     max_bytes=TRACE_MAX_BYTES)
+        return result
+    
+    async def tick():
+        # Scheduled email checks are incremental so each tick only reports new mail
+        checks = (('email', gmail.check_urgent_emails, EMAIL_HOURS, True, use_async),
+                  ('calendar', calendar.check_upcoming_events, CALENDAR_HOURS, use_async))
+        for key, fn, *args in checks:
+            try:
+                await run_check(key, fn, *args)
+            except Exception as e:
+                # A failed state or trace write (full disk, permissions) mustn't stop the daemon
+                instrumentation.error(f'tick.{key}', e)
+                print(f"⚠️  Heartbeat {key} check failed: {e}", file=sys.stderr)
+    
+    async def handle(reader, writer):
+        try:
+            words = (await reader.readline()).decode().split()
+            command = words[0] if words else 'status'
+            hours = int(words[1]) if len(words) > 1 else None
+            if command == 'status':
+                reply = latest
+            elif command == 'email':
+                reply = await run_check('email', gmail.check_urgent_emails, hours or EMAIL_HOURS,
+                                        False, use_async)
+            elif command == 'calendar':
+                reply = await run_check('calendar', calendar.check_upcoming_events,
+                                        hours or CALENDAR_HOURS, use_async)
+            else:
+                reply = {'error': f'Unknown command: {command}'}
+        except Exception as e:
+            reply = {'error': str(e)}
+        writer.write((json.dumps(reply, indent=2) + '\n').encode())
+        await writer.drain()
+        writer.close()
+    
+    if os.path.exists(SOCKET_FILE):
+        os.remove(SOCKET_FILE)
+    server = await asyncio.start_unix_server(handle, path=SOCKET_FILE)
+    print(f"💓 Heartbeat daemon listening on {SOCKET_FILE}", file=sys.stderr)
+    
+    async with server:
+        while True:
+            await tick()
+            await asyncio.sleep(INTERVAL_MINUTES * 60)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Heartbeat daemon for the email and calendar checks')
+    parser.add_argument('--ask', nargs='+', metavar='COMMAND',
+                        help='query a running daemon: status, email [hours] or calendar [hours]')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='run the checks over the aiohttp client (google_async)')
+    args = parser.parse_args()
+    if args.ask:
+        sys.exit(ask(args.ask))
+    try:
+        asyncio.run(serve(args.use_async))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(SOCKET_FILE):
+            os.remove(SOCKET_FILE)
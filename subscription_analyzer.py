@@ -2,172 +2,177 @@
 """
 Subscription Analyzer with Data Visualization
 Categorizes subscriptions as monthly vs yearly and shows spending breakdown
+
+Usage:
+  python3 subscription_analyzer.py            # scan Gmail, print and snapshot the report
+  python3 subscription_analyzer.py report     # print the last snapshot, no network
+  python3 subscription_analyzer.py refresh    # quietly add new receipts to the snapshot
+
+refresh is meant to run in the background, e.g. from cron:
+  0 6 * * * cd /Users/cpuai/.openclaw/workspace && python3 subscription_analyzer.py refresh
 """
 
-import os.path
-import pickle
-import re
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from collections import defaultdict
-import base64
 from datetime import datetime
+from itertools import islice
+import argparse
+import sys
+from google_client import get_service
+from gmail_search import search_messages
+from gmail_history import incremental_search
+from message_cache import open_cache, get_message
+from message_index import indexed_search
+from gmail_pipeline import ingest, add_pipeline_arguments
+from subscription_classifier import classify
+from subscription_ledger import Ledger, rollup
+from email_dates import message_timestamp
+from recurring_charges import detect_recurring, fill_frequencies
+from instrumentation import span, error, report_at_exit
+from scan_checkpoint import run_segments
+from subscription_snapshot import (SNAPSHOT_FILE, build_snapshot, save_snapshot, load_snapshot,
+                                   snapshot_ledger, snapshot_recurring, by_frequency)
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+CHECKPOINT_FILE = 'subscription_analyzer_checkpoint.json'
+REFRESH_STATE = 'subscription_analyzer_refresh'
 
-def authenticate():
+QUERIES = [
+    'subject:"monthly subscription" OR subject:"annual subscription"',
+    'subject:"subscription renewal"',
+    'subject:"your subscription"',
+    'from:(billing@anthropic OR noreply@apple OR billing@spline)',
+    'subject:"your plan" OR subject:"membership"',
+    '"recurring charge" OR "auto-renewal" OR "subscription fee"'
+]
+
+def authenticate(use_async=False):
     """Handles OAuth authentication"""
-    creds = None
-    if os.path.exists('gmail_token.pickle'):
-        with open('gmail_token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'gmail_credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('gmail_token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-    
-    return build('gmail', 'v1', credentials=creds)
+    return get_service('gmail', 'v1', token_file='gmail_token.pickle', scopes=SCOPES,
+                       credentials_file='gmail_credentials.json', use_async=use_async)
 
-def search_subscription_emails(service):
-    """Search for recurring subscription emails"""
-    queries = [
-        'subject:"monthly subscription" OR subject:"annual subscription"',
-        'subject:"subscription renewal"',
-        'subject:"your subscription"',
-        'from:(billing@anthropic OR noreply@apple OR billing@spline)',
-        'subject:"your plan" OR subject:"membership"',
-        '"recurring charge" OR "auto-renewal" OR "subscription fee"'
-    ]
-    
-    all_messages = []
-    seen_ids = set()
+def search_subscription_emails(service, after=None, ordered=True):
+    """
+    Search for recurring subscription emails, optionally only newer than
+    after (epoch seconds). Yields message stubs as results stream in,
+    query by query unless ordered=False (fine when every result is used).
+    """
+    queries = QUERIES
+    if after:
+        queries = [f'({query}) after:{int(after)}' for query in queries]
     
     print("🔍 Searching for subscription emails...")
     
-    for query in queries:
-        try:
-            results = service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=200
-            ).execute()
-            
-            messages = results.get('messages', [])
-            for msg in messages:
-                if msg['id'] not in seen_ids:
-                    all_messages.append(msg)
-                    seen_ids.add(msg['id'])
-        except Exception as e:
-            pass
-    
-    return all_messages
+    # Queries run concurrently; pages are yielded as soon as their turn comes
+    yield from search_messages(service, queries, ordered=ordered)
 
-def extract_email_details(service, message_id):
+def extract_email_details(service, message_id, cache=None):
     """Extract subscription details from email"""
     try:
-        msg = service.users().messages().get(
-            userId='me', 
-            id=message_id,
-            format='full'
-        ).execute()
-        
-        headers = msg['payload']['headers']
-        subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), '')
-        sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), '')
-        date_str = next((h['value'] for h in headers if h['name'].lower() == 'date'), '')
-        
-        # Get email body
-        body = ''
-        if 'parts' in msg['payload']:
-            for part in msg['payload']['parts']:
-                if part['mimeType'] == 'text/plain' and 'data' in part['body']:
-                    body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
-                    break
-        elif 'body' in msg['payload'] and 'data' in msg['payload']['body']:
-            body = base64.urlsafe_b64decode(msg['payload']['body']['data']).decode('utf-8', errors='ignore')
+        return parse_email_details(get_message(service, message_id, cache))
+    except Exception as e:
+        error('extract', e)
+        return None
+
+def parse_email_details(message):
+    """Extract subscription details from a parsed message"""
+    try:
+        subject = message['subject']
+        sender = message['sender']
+        date_str = message['date']
+        body = message['body']
         
         text = subject + ' ' + body
         
-        # Extract company name
-        company = ''
-        if 'anthropic' in sender.lower():
-            company = 'Anthropic Claude'
-        elif 'apple' in sender.lower():
-            company = 'Apple'
-        elif 'spline' in sender.lower():
-            company = 'Spline'
-        elif 'autodesk' in sender.lower():
-            company = 'Autodesk'
-        elif 'polycam' in sender.lower():
-            company = 'Polycam'
-        else:
+        # Vendor, amount and frequency from the compiled vendor table
+        with span('classify'):
+            company, amount, frequency = classify(sender, text)
+        if company is None:
             # Extract from sender
             if '<' in sender:
                 company = sender.split('<')[0].strip().strip('"')
             else:
                 company = sender.split('@')[-1].split('.')[0] if '@' in sender else sender
         
-        # Extract amount
-        amounts = re.findall(r'\$(\d+(?:,\d{3})*(?:\.\d{2})?)', text)
-        amount = None
-        if amounts:
-            # Get the first non-zero amount
-            for amt in amounts:
-                val = float(amt.replace(',', ''))
-                if val > 0:
-                    amount = val
-                    break
-        
-        # Detect frequency
-        frequency = None
-        text_lower = text.lower()
-        if 'monthly' in text_lower or 'per month' in text_lower or '/month' in text_lower:
-            frequency = 'monthly'
-        elif 'annual' in text_lower or 'yearly' in text_lower or 'per year' in text_lower or '/year' in text_lower:
-            frequency = 'yearly'
-        
         return {
             'company': company[:40],
             'amount': amount,
             'frequency': frequency,
             'subject': subject[:80],
             'sender': sender[:60],
-            'date': date_str[:30]
+            'date': date_str[:30],
+            'timestamp': message_timestamp(message)
         }
     except Exception as e:
+        error('classify', e)
         return None
 
 def categorize_subscriptions(subscriptions):
-    """Group subscriptions by company and frequency"""
-    monthly = {}
-    yearly = {}
-    unknown = {}
+    """Group subscriptions by company and frequency, keeping each company's largest amount"""
+    if not isinstance(subscriptions, Ledger):
+        subscriptions = Ledger.from_records(subscriptions)
+    return subscriptions.by_frequency('max')
+
+def collect_ids(messages, seen):
+    """Message IDs from a stream of stubs, noting each one in seen as it goes by"""
+    for msg in messages:
+        seen.add(msg['id'])
+        yield msg['id']
+
+def analyze_messages(service, message_ids, subscriptions, cache=None, workers=0,
+                     processed=0, report_every=20):
+    """
+    Fetch and classify message_ids into the subscriptions ledger.
+    Returns the running count of candidates analyzed.
+    """
+    return ingest(service, message_ids, parse_email_details, subscriptions.add,
+                  cache, workers, processed, report_every)
+
+def full_scan(service, messages, cache, args):
+    """
+    Analyze every search result, checkpointing every few hundred
+    messages so an interrupted scan resumes where it stopped
+    """
+    subscriptions = Ledger()
+    processed = 0
     
-    for sub in subscriptions:
-        if not sub['amount']:
-            continue
-        
-        company = sub['company']
-        
-        if sub['frequency'] == 'monthly':
-            if company not in monthly or monthly[company] < sub['amount']:
-                monthly[company] = sub['amount']
-        elif sub['frequency'] == 'yearly':
-            if company not in yearly or yearly[company] < sub['amount']:
-                yearly[company] = sub['amount']
-        else:
-            if company not in unknown or unknown[company] < sub['amount']:
-                unknown[company] = sub['amount']
+    def process(segment):
+        nonlocal processed
+        processed = analyze_messages(service, segment, subscriptions, cache, args.workers,
+                                     processed, report_every=0)
+    
+    def save():
+        return {'ledger': subscriptions.to_state(), 'processed': processed}
+    
+    def restore(state):
+        nonlocal subscriptions, processed
+        subscriptions = Ledger.from_state(state['ledger'])
+        processed = state['processed']
     
-    return monthly, yearly, unknown
+    covered = run_segments(args, messages, process, save, restore)
+    return subscriptions, processed, covered
+
+def refresh_snapshot(service, cache, args):
+    """
+    Fold receipts the snapshot doesn't cover yet into it. Uses its own
+    history state, so one history.list call is all it costs when no
+    mail has arrived.
+    """
+    snapshot = load_snapshot(args.snapshot)
+    if snapshot:
+        subscriptions, covered = snapshot_ledger(snapshot)
+        processed = snapshot['processed']
+    else:
+        subscriptions, covered, processed = Ledger(), set(), 0
+    
+    messages = incremental_search(
+        service, REFRESH_STATE,
+        lambda after=None: search_subscription_emails(service, after=after))
+    new_ids = [msg['id'] for msg in messages if msg['id'] not in covered]
+    processed = analyze_messages(service, new_ids, subscriptions, cache, args.workers,
+                                 processed, report_every=0)
+    covered.update(new_ids)
+    save_snapshot(build_snapshot(subscriptions, covered, processed), args.snapshot)
+    print(f"💾 Snapshot refreshed: {len(new_ids)} new emails, {processed} analyzed in total")
 
 def print_bar_chart(label, value, max_value, width=40):
     """Print a simple text bar chart"""
@@ -178,36 +183,33 @@ def print_bar_chart(label, value, max_value, width=40):
     bar = '█' * bar_width
     return f"{label:30} {bar:40} ${value:,.2f}"
 
-def main():
+def print_recurring(recurring):
+    """Billing periods inferred from receipt dates, with price changes and lapses"""
     print("\n" + "="*70)
-    print("  💰 SUBSCRIPTION ANALYZER")
+    print("  🔁 RECURRING CHARGES (from receipt dates)")
     print("="*70 + "\n")
     
-    service = authenticate()
-    
-    messages = search_subscription_emails(service)
-    print(f"📧 Found {len(messages)} potential subscription emails\n")
-    
-    if not messages:
-        print("❌ No subscription emails found!")
+    if not recurring:
+        print("   Not enough dated receipts to spot a billing cycle yet")
         return
-    
-    print("📊 Analyzing subscriptions...\n")
-    subscriptions = []
-    for i, msg in enumerate(messages[:150], 1):
-        if i % 20 == 0:
-            print(f"   Processed {i}/{min(150, len(messages))} emails...")
-        details = extract_email_details(service, msg['id'])
-        if details and details['amount']:
-            subscriptions.append(details)
-    
-    monthly, yearly, unknown = categorize_subscriptions(subscriptions)
-    
-    # Calculate totals
-    monthly_total = sum(monthly.values())
-    yearly_total = sum(yearly.values())
-    monthly_equiv_yearly = monthly_total * 12
-    total_annual_cost = monthly_equiv_yearly + yearly_total
+    for charge in recurring:
+        last = datetime.fromtimestamp(charge.last_seen)
+        print(f"  • {charge.company[:28]:28} {charge.period:9} ${charge.amount:>9,.2f}"
+              f"  last {last:%Y-%m-%d}  ({charge.charges} charges)")
+        if charge.price_changes:
+            when, old, new = charge.price_changes[-1]
+            print(f"      💲 price changed ${old:,.2f} → ${new:,.2f} on "
+                  f"{datetime.fromtimestamp(when):%Y-%m-%d}")
+        if charge.status == 'cancelled':
+            due = datetime.fromtimestamp(charge.next_due)
+            print(f"      🛑 looks cancelled: next charge was due {due:%Y-%m-%d}")
+
+def print_report(monthly, yearly, unknown, totals, recurring=()):
+    """Print the monthly/yearly charts, recurring charges and annual totals"""
+    monthly_total = totals['monthly_total']
+    yearly_total = totals['yearly_total']
+    monthly_equiv_yearly = totals['monthly_equiv_yearly']
+    total_annual_cost = totals['total_annual_cost']
     
     # Print results
     print("\n" + "="*70)
@@ -244,6 +246,8 @@ def main():
         for company, amount in sorted(unknown.items(), key=lambda x: x[1], reverse=True)[:5]:
             print(f"  • {company}: ${amount:,.2f}")
     
+    print_recurring(recurring)
+    
     # Summary
     print("\n" + "="*70)
     print("  💵 TOTAL ANNUAL SPENDING")
@@ -268,5 +272,85 @@ def main():
     
     print("\n" + "="*70 + "\n")
 
+def print_snapshot(path):
+    """Render a saved snapshot without touching the network"""
+    snapshot = load_snapshot(path)
+    if snapshot is None:
+        print(f"❌ No snapshot in {path} yet. Run a scan first.")
+        return 1
+    generated = datetime.fromtimestamp(snapshot['generated'])
+    print(f"📂 Snapshot from {generated:%Y-%m-%d %H:%M} "
+          f"({snapshot['processed']} potential subscription emails analyzed)")
+    recurring = snapshot_recurring(snapshot)
+    monthly, yearly, unknown = fill_frequencies(*by_frequency(snapshot), recurring)
+    print_report(monthly, yearly, unknown, snapshot['totals'], recurring)
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Subscription Analyzer with Data Visualization')
+    parser.add_argument('mode', nargs='?', default='scan', choices=('scan', 'report', 'refresh'),
+                        help='scan Gmail (default), print the saved snapshot, or update it quietly')
+    parser.add_argument('--snapshot', default=SNAPSHOT_FILE, metavar='FILE',
+                        help=f'summary snapshot to write or read (default {SNAPSHOT_FILE})')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only search mail added since the last --incremental run')
+    parser.add_argument('--local', action='store_true',
+                        help='answer the queries from the local message index; '
+                             'only search Gmail for new mail')
+    add_pipeline_arguments(parser, CHECKPOINT_FILE, 150)
+    args = parser.parse_args()
+    if args.full and args.incremental:
+        parser.error('--full and --incremental are mutually exclusive')
+    if args.local and (args.incremental or args.no_cache):
+        parser.error('--local needs the message cache and replaces --incremental')
+    report_at_exit('subscription_analyzer', args.profile, args.trace)
+    
+    if args.mode == 'refresh':
+        refresh_snapshot(authenticate(args.use_async), None if args.no_cache else open_cache(), args)
+        return
+    
+    print("\n" + "="*70)
+    print("  💰 SUBSCRIPTION ANALYZER")
+    print("="*70 + "\n")
+    
+    if args.mode == 'report':
+        sys.exit(print_snapshot(args.snapshot))
+    
+    service = authenticate(args.use_async)
+    cache = None if args.no_cache else open_cache()
+    
+    if args.local:
+        messages = indexed_search(
+            service, 'subscription_analyzer_local', QUERIES,
+            lambda after=None: search_subscription_emails(service, after=after), cache)
+    elif args.incremental:
+        messages = incremental_search(
+            service, 'subscription_analyzer',
+            lambda after=None: search_subscription_emails(service, after=after))
+    else:
+        messages = search_subscription_emails(service, ordered=not args.full)
+    
+    # Extraction starts as soon as the first search page arrives
+    print("📊 Analyzing subscriptions...\n")
+    if args.full:
+        subscriptions, processed, covered = full_scan(service, messages, cache, args)
+    else:
+        subscriptions = Ledger()
+        covered = set()
+        message_ids = collect_ids(islice(messages, 150), covered)
+        processed = analyze_messages(service, message_ids, subscriptions, cache, args.workers)
+    
+    if not processed:
+        print("❌ No subscription emails found!")
+        return
+    print(f"\n📧 Analyzed {processed} potential subscription emails")
+    
+    save_snapshot(build_snapshot(subscriptions, covered, processed), args.snapshot)
+    
+    # Vendors that never say "monthly" still get placed by their billing cycle
+    recurring = detect_recurring(subscriptions)
+    monthly, yearly, unknown = fill_frequencies(*categorize_subscriptions(subscriptions), recurring)
+    print_report(monthly, yearly, unknown, rollup(monthly, yearly), recurring)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Compiled subscription classifier
+Vendor and frequency keywords come from subscription_vendors.json and are
+compiled once into flat lowercase lookup tables; classify() then finds
+vendor, amount and billing frequency with one lowercase of each string
+"""
+
+import json
+import os
+import re
+
+VENDORS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'subscription_vendors.json')
+
+# The literal '$' prefix lets the regex engine skip straight to candidates
+AMOUNT_RE = re.compile(r'\$(\d+(?:,\d{3})*(?:\.\d{2})?)')
+PRICE_RE = re.compile(r'\$\d+(?:,\d{3})*(?:\.\d{2})?')
+
+def load_classifier(path=VENDORS_FILE):
+    """
+    Compile the vendor table into (keyword, name) tuples in priority
+    order, keywords lowercased up front, so classify() only does
+    substring checks on one lowered copy of each string.
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    def flatten(entries):
+        return tuple((keyword.lower(), e['name']) for e in entries for keyword in e['keywords'])
+
+    return {
+        'vendors': flatten(config['vendors']),
+        'frequencies': flatten(config['frequencies'])
+    }
+
+_default = None
+
+def default_classifier():
+    """The classifier for the bundled vendor table, compiled once"""
+    global _default
+    if _default is None:
+        _default = load_classifier()
+    return _default
+
+def classify(sender, text, classifier=None):
+    """
+    Returns (vendor, amount, frequency): the first configured vendor
+    whose keyword appears in sender, the first non-zero '$' amount in
+    text as a float, and the highest-priority frequency with a keyword
+    in text. Each is None when nothing matches.
+    """
+    classifier = classifier or default_classifier()
+
+    vendor = None
+    sender_lower = sender.lower()
+    for keyword, name in classifier['vendors']:
+        if keyword in sender_lower:
+            vendor = name
+            break
+
+    amount = None
+    for digits in AMOUNT_RE.findall(text):
+        val = float(digits.replace(',', ''))
+        if val > 0:
+            amount = val
+            break
+
+    frequency = None
+    text_lower = text.lower()
+    for keyword, name in classifier['frequencies']:
+        if keyword in text_lower:
+            frequency = name
+            break
+
+    return vendor, amount, frequency
+
+def find_amounts(text):
+    """Every '$X.XX' string in text, in order"""
+    return PRICE_RE.findall(text)
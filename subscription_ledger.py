@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Columnar subscription ledger
+Stores extracted receipts as parallel typed arrays with interned company
+names, so years of receipts stay small and group-bys are cheap
+"""
+
+from array import array
+from statistics import median
+
+FREQUENCIES = ('monthly', 'yearly', None)
+FREQUENCY_CODES = {name: code for code, name in enumerate(FREQUENCIES)}
+
+STATS = ('max', 'latest', 'median')
+
+def rollup(monthly, yearly):
+    """Monthly/yearly totals and the combined annual cost of company -> amount dicts"""
+    monthly_total = sum(monthly.values())
+    yearly_total = sum(yearly.values())
+    return {
+        'monthly_total': monthly_total,
+        'yearly_total': yearly_total,
+        'monthly_equiv_yearly': monthly_total * 12,
+        'total_annual_cost': monthly_total * 12 + yearly_total
+    }
+
+class Ledger:
+    """One row per receipt: company code, frequency code, amount, timestamp"""
+    
+    __slots__ = ('companies', '_company_codes', 'company', 'frequency', 'amount', 'timestamp')
+    
+    def __init__(self):
+        self.companies = []        # code -> name
+        self._company_codes = {}   # name -> code
+        self.company = array('I')
+        self.frequency = array('b')
+        self.amount = array('d')
+        self.timestamp = array('q')
+    
+    def __len__(self):
+        return len(self.amount)
+    
+    def append(self, company, amount, frequency=None, timestamp=0):
+        code = self._company_codes.get(company)
+        if code is None:
+            code = len(self.companies)
+            self._company_codes[company] = code
+            self.companies.append(company)
+        self.company.append(code)
+        self.frequency.append(FREQUENCY_CODES.get(frequency, FREQUENCY_CODES[None]))
+        self.amount.append(amount)
+        self.timestamp.append(timestamp)
+    
+    def add(self, details):
+        """Append an extract_email_details() record (skips ones without an amount)"""
+        if details and details['amount']:
+            self.append(details['company'], details['amount'], details['frequency'],
+                        details.get('timestamp', 0))
+    
+    @classmethod
+    def from_records(cls, records):
+        ledger = cls()
+        for details in records:
+            ledger.add(details)
+        return ledger
+    
+    def to_state(self):
+        """JSON-ready copy of the columns, for checkpoints"""
+        return {
+            'companies': self.companies,
+            'company': self.company.tolist(),
+            'frequency': self.frequency.tolist(),
+            'amount': self.amount.tolist(),
+            'timestamp': self.timestamp.tolist()
+        }
+    
+    @classmethod
+    def from_state(cls, state):
+        ledger = cls()
+        ledger.companies = list(state['companies'])
+        ledger._company_codes = {name: code for code, name in enumerate(ledger.companies)}
+        ledger.company.extend(state['company'])
+        ledger.frequency.extend(state['frequency'])
+        ledger.amount.extend(state['amount'])
+        ledger.timestamp.extend(state['timestamp'])
+        return ledger
+    
+    def groups(self):
+        """{(company code, frequency code): [row, ...]} in first-seen order"""
+        groups = {}
+        for row, key in enumerate(zip(self.company, self.frequency)):
+            rows = groups.get(key)
+            if rows is None:
+                groups[key] = [row]
+            else:
+                rows.append(row)
+        return groups
+    
+    def group_by(self, stat='max'):
+        """
+        {(company, frequency): value} for stat in STATS. 'latest' is the
+        amount on the most recent receipt (ties go to the later row).
+        """
+        if stat not in STATS:
+            raise ValueError(f"Unknown stat {stat!r}, expected one of {STATS}")
+        amount = self.amount
+        timestamp = self.timestamp
+        result = {}
+        for (company, frequency), rows in self.groups().items():
+            if stat == 'max':
+                value = max(amount[row] for row in rows)
+            elif stat == 'latest':
+                value = amount[max(rows, key=lambda row: (timestamp[row], row))]
+            else:
+                value = median(amount[row] for row in rows)
+            result[(self.companies[company], FREQUENCIES[frequency])] = value
+        return result
+    
+    def by_frequency(self, stat='max'):
+        """(monthly, yearly, unknown) dicts of company -> stat value"""
+        split = {name: {} for name in FREQUENCIES}
+        for (company, frequency), value in self.group_by(stat).items():
+            split[frequency][company] = value
+        return split['monthly'], split['yearly'], split[None]
+    
+    def rollup(self, stat='max'):
+        """Monthly/yearly totals and the combined annual cost"""
+        monthly, yearly, _ = self.by_frequency(stat)
+        return rollup(monthly, yearly)
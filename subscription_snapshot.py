@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Subscription summary snapshots
+The analyzer's results (per-company amounts, frequencies, last-seen
+dates and totals, plus the ledger they came from) saved as versioned
+JSON, so reports render instantly offline and refreshes only have to
+add new receipts
+"""
+
+import json
+import os
+import time
+from subscription_ledger import Ledger, FREQUENCIES, rollup
+from recurring_charges import RecurringCharge, detect_recurring, fill_frequencies
+from atomic_file import write_json
+
+SNAPSHOT_FILE = 'subscription_snapshot.json'
+VERSION = 2
+
+def build_snapshot(ledger, message_ids, processed, stat='max'):
+    """Summarize ledger; message_ids are every message it already covers"""
+    values = ledger.group_by(stat)
+    recurring = detect_recurring(ledger)
+    periods = {charge.company: charge.period for charge in recurring}
+    receipts = {}
+    last_seen = {}
+    for (company, frequency), rows in ledger.groups().items():
+        key = (ledger.companies[company], FREQUENCIES[frequency])
+        receipts[key] = len(rows)
+        last_seen[key] = max(ledger.timestamp[row] for row in rows)
+    
+    companies = [
+        {
+            'company': company,
+            'frequency': frequency,
+            'period': periods.get(company),
+            'amount': amount,
+            'receipts': receipts[(company, frequency)],
+            'last_seen': last_seen[(company, frequency)]
+        }
+        for (company, frequency), amount in values.items()
+    ]
+    monthly, yearly, _ = fill_frequencies(*ledger.by_frequency(stat), recurring)
+    return {
+        'version': VERSION,
+        'generated': int(time.time()),
+        'stat': stat,
+        'processed': processed,
+        'companies': companies,
+        'recurring': [charge._asdict() for charge in recurring],
+        'totals': rollup(monthly, yearly),
+        'ledger': ledger.to_state(),
+        'message_ids': sorted(message_ids)
+    }
+
+def save_snapshot(snapshot, path=SNAPSHOT_FILE):
+    write_json(path, snapshot)
+
+def load_snapshot(path=SNAPSHOT_FILE):
+    """The saved snapshot, or None if there isn't a readable one of this version"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get('version') != VERSION:
+        return None
+    return snapshot
+
+def snapshot_ledger(snapshot):
+    """Ledger and covered message IDs to continue from"""
+    return Ledger.from_state(snapshot['ledger']), set(snapshot['message_ids'])
+
+def snapshot_recurring(snapshot):
+    return [RecurringCharge(**charge) for charge in snapshot['recurring']]
+
+def by_frequency(snapshot):
+    """
+    (monthly, yearly, unknown) dicts of company -> amount, like
+    Ledger.by_frequency (frequencies as worded, before fill_frequencies)
+    """
+    split = {name: {} for name in FREQUENCIES}
+    for entry in snapshot['companies']:
+        split[entry['frequency']][entry['company']] = entry['amount']
+    return split['monthly'], split['yearly'], split[None]
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Both subscription reports from one pass over Gmail
+gmail_subscription_scanner.py (amounts per company) and
+subscription_analyzer.py (monthly/yearly breakdown) search overlapping
+mail. Run together here, each candidate in the union of their searches
+is fetched and parsed once, and every parsed message feeds whichever
+reports' searches found it.
+
+Usage:
+  python3 subscriptions.py                # both reports
+  python3 subscriptions.py scan           # amounts per company only
+  python3 subscriptions.py analyze        # monthly/yearly breakdown only
+  python3 subscriptions.py --full         # every match, resumable, instead of the newest few
+"""
+
+import argparse
+from collections import Counter
+from itertools import islice
+from message_cache import open_cache
+from gmail_pipeline import ingest, add_pipeline_arguments
+from subscription_ledger import Ledger, rollup
+from recurring_charges import detect_recurring, fill_frequencies
+from subscription_snapshot import SNAPSHOT_FILE, build_snapshot, save_snapshot
+from scan_checkpoint import run_segments
+from instrumentation import report_at_exit
+import gmail_subscription_scanner as scanner
+import subscription_analyzer as analyzer
+
+CHECKPOINT_FILE = 'subscriptions_checkpoint.json'
+REPORTS = ('scan', 'analyze')
+
+# How many of the newest search results each report looks at without --full
+NEWEST = {'scan': 100, 'analyze': 150}
+
+def find_candidates(service, reports, full=False):
+    """{report: message IDs its own queries find}, newest first"""
+    found = {}
+    if 'scan' in reports:
+        messages = scanner.search_subscription_emails(service, max_results=None if full else 500,
+                                                      ordered=not full)
+        found['scan'] = [msg['id'] for msg in islice(messages, None if full else NEWEST['scan'])]
+    if 'analyze' in reports:
+        messages = analyzer.search_subscription_emails(service, ordered=not full)
+        found['analyze'] = [msg['id'] for msg in islice(messages, None if full else NEWEST['analyze'])]
+    return found
+
+def extract_both(message):
+    """(id, scanner info, analyzer details) for one parsed message"""
+    return (message['id'], scanner.parse_subscription_info(message),
+            analyzer.parse_email_details(message))
+
+class Reports:
+    """Both reports' aggregates, plus which messages each report's search found"""
+    
+    def __init__(self, found):
+        self.found = {report: set(ids) for report, ids in found.items()}
+        self.subscriptions = {}
+        self.ledger = Ledger()
+        self.processed = Counter()
+    
+    def add(self, message_id, info, details):
+        if message_id in self.found.get('scan', ()):
+            self.processed['scan'] += 1
+            scanner.add_info(self.subscriptions, info)
+        if message_id in self.found.get('analyze', ()):
+            self.processed['analyze'] += 1
+            self.ledger.add(details)
+    
+    def to_state(self):
+        """JSON-ready aggregates, for checkpoints"""
+        subscriptions = {company: dict(summary, amounts=sorted(summary['amounts']))
+                         for company, summary in self.subscriptions.items()}
+        return {'subscriptions': subscriptions, 'ledger': self.ledger.to_state(),
+                'processed': dict(self.processed)}
+    
+    def restore(self, state):
+        for company, summary in state['subscriptions'].items():
+            self.subscriptions[company] = dict(summary, amounts=set(summary['amounts']))
+        self.ledger = Ledger.from_state(state['ledger'])
+        self.processed.update(state['processed'])
+
+def fetch_reports(service, message_ids, reports, cache=None, workers=0, report_every=50):
+    """
+    Fetch and parse message_ids once each and feed them to reports.
+    Returns the number of candidates that made it past the pipeline's
+    first stage.
+    """
+    return ingest(service, message_ids, extract_both, lambda record: reports.add(*record),
+                  cache, workers, report_every=report_every)
+
+def full_ingest(service, message_ids, reports, cache, args):
+    """fetch_reports() with a checkpoint after every segment, so --full scans resume"""
+    return run_segments(
+        args, ({'id': m} for m in message_ids),
+        lambda segment: fetch_reports(service, segment, reports, cache, args.workers, report_every=0),
+        reports.to_state, reports.restore)
+
+def main():
+    parser = argparse.ArgumentParser(description='Subscription reports from one pass over Gmail')
+    parser.add_argument('report', nargs='?', default='all', choices=('all',) + REPORTS,
+                        help='which report to print (default: both, sharing one fetch)')
+    parser.add_argument('--snapshot', default=SNAPSHOT_FILE, metavar='FILE',
+                        help=f'where the analyze report saves its snapshot (default {SNAPSHOT_FILE})')
+    add_pipeline_arguments(parser, CHECKPOINT_FILE, 'few')
+    args = parser.parse_args()
+    report_at_exit('subscriptions', args.profile, args.trace)
+    reports_wanted = REPORTS if args.report == 'all' else (args.report,)
+    
+    print("\n" + "="*70)
+    print("  💰 SUBSCRIPTIONS")
+    print("="*70 + "\n")
+    
+    service = analyzer.authenticate(args.use_async)
+    cache = None if args.no_cache else open_cache()
+    
+    found = find_candidates(service, reports_wanted, args.full)
+    message_ids = list(dict.fromkeys(m for ids in found.values() for m in ids))
+    print(f"📊 Analyzing {len(message_ids)} emails, fetching each once...\n")
+    reports = Reports(found)
+    if args.full:
+        covered = full_ingest(service, message_ids, reports, cache, args)
+    else:
+        fetch_reports(service, message_ids, reports, cache, args.workers)
+        covered = set(found.get('analyze', ()))
+    
+    if 'scan' in reports_wanted:
+        processed = reports.processed['scan']
+        if processed:
+            print(f"\n📧 Analyzed {processed} subscription-related emails")
+            scanner.print_summary(reports.subscriptions)
+        else:
+            print("❌ No subscription emails found!")
+    
+    if 'analyze' in reports_wanted:
+        processed = reports.processed['analyze']
+        if not processed:
+            print("❌ No subscription emails found!")
+            return
+        print(f"\n📧 Analyzed {processed} potential subscription emails")
+        ledger = reports.ledger
+        save_snapshot(build_snapshot(ledger, covered & set(found['analyze']), processed), args.snapshot)
+        recurring = detect_recurring(ledger)
+        monthly, yearly, unknown = fill_frequencies(*ledger.by_frequency('max'), recurring)
+        analyzer.print_report(monthly, yearly, unknown, rollup(monthly, yearly), recurring)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Cross-process OAuth token store
+Every script and the heartbeat daemon share the same pickled tokens.
+Writes are atomic and made under an flock, and refreshes are
+single-flight: whichever process takes the lock first refreshes, the
+rest pick up its token from disk. Long-running processes also refresh a
+few minutes before expiry on a timer, so no request waits on it.
+"""
+
+import datetime
+import fcntl
+import os
+import pickle
+import sys
+import threading
+from instrumentation import span, incr, error
+from atomic_file import write_atomic
+
+# Refresh this long before the access token expires
+REFRESH_MARGIN_SECONDS = 300
+# Don't retry a failed proactive refresh sooner than this
+RETRY_SECONDS = 60
+
+def _utcnow():
+    # google-auth keeps expiry as a naive UTC datetime
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def seconds_left(creds):
+    """Seconds until creds' access token expires (None if it doesn't say)"""
+    expiry = getattr(creds, 'expiry', None)
+    if expiry is None:
+        return None
+    return (expiry - _utcnow()).total_seconds()
+
+def needs_refresh(creds, margin=REFRESH_MARGIN_SECONDS):
+    left = seconds_left(creds)
+    return not creds.token or (left is not None and left < margin)
+
+class _FileLock:
+    """Exclusive flock on path, shared by processes and serialized across threads"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+    
+    def __enter__(self):
+        self._thread_lock.acquire()
+        self._file = open(self.path, 'a')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+        self._thread_lock.release()
+        return False
+
+class TokenStore:
+    """One token file; use token_store(path) to share an instance per process"""
+    
+    def __init__(self, path, margin=REFRESH_MARGIN_SECONDS):
+        self.path = path
+        self.margin = margin
+        self.lock = _FileLock(path + '.lock')
+        self._timer = None
+    
+    def load(self):
+        """Credentials on disk, or None. Readers never need the lock: writes are atomic."""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            return pickle.load(f)
+    
+    def save(self, creds):
+        with self.lock:
+            self._write(creds)
+    
+    def _write(self, creds):
+        write_atomic(self.path, pickle.dumps(creds), 'wb')
+    
+    def refresh(self, creds, force=False):
+        """
+        Make creds good for at least margin more seconds, refreshing at
+        most once across processes: under the lock, a token another
+        process already refreshed is adopted instead. Updates creds in
+        place (services hold on to it) and returns it.
+        """
+        from google.auth.transport.requests import Request
+        with self.lock:
+            stored = self.load()
+            if stored is not None and stored.token != creds.token and not needs_refresh(stored, self.margin):
+                creds.token = stored.token
+                creds.expiry = stored.expiry
+                incr('auth.adopted')
+                return creds
+            if not force and not needs_refresh(creds, self.margin):
+                return creds
+            print("Refreshing expired token...", file=sys.stderr)
+            with span('auth'):
+                creds.refresh(Request())
+            incr('auth.refreshes')
+            self._write(creds)
+        return creds
+    
+    def keep_fresh(self, creds):
+        """Refresh creds margin seconds before each expiry, on a daemon timer thread"""
+        if self._timer is not None or not getattr(creds, 'refresh_token', None):
+            return
+        self._schedule(creds)
+    
+    def _schedule(self, creds, delay=None):
+        if delay is None:
+            left = seconds_left(creds)
+            if left is None:
+                return
+            delay = max(0, left - self.margin)
+        self._timer = threading.Timer(delay, self._refresh_in_background, (creds,))
+        self._timer.daemon = True
+        self._timer.start()
+    
+    def _refresh_in_background(self, creds):
+        try:
+            self.refresh(creds)
+        except Exception as e:
+            error('token_refresh', e)
+            self._schedule(creds, RETRY_SECONDS)
+            return
+        self._schedule(creds)
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def token_store(path):
+    """The process-wide TokenStore for path"""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = TokenStore(path)
+        return store